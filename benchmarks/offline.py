@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Offline throughput benchmark. Files are recognized with recognize() against local stand-ins of Google Speech and GCS,
+Yandex SpeechKit gRPC service and Wit HTTP API, which answer with configurable latency and jitter. Audio is
+synthetic call audio of different duration and count of channels. Every method is run in fresh interpreter, so
+peak RSS is measured per method.
+
+    $ python benchmarks/offline.py --files=40 --workers=8 --latency=0.2 --jitter=0.05
+
+Output is one JSON line per method with files/sec, latency percentiles of every pipeline stage and peak RSS.
+Method "hot_paths" measures split_pcm, split_by_ffmpeg and YandexSTT.gen without any server.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from array import array
+from types import SimpleNamespace
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+sys.path.insert(0, ROOT_DIR)
+
+from lib import metrics
+from lib.audio import write_wav, SAMPLE_WIDTH
+from lib.credentials import GlobalConfig, GoogleASR, YandexASR, WitASR
+
+METHODS = ('google', 'yandex', 'wit', 'hot_paths')
+
+FAKE_TEXT = 'benchmark transcript'
+
+
+class Latency(object):
+    """Answer delay of fake server: base latency with uniform jitter plus time proportional to audio duration.
+
+        :type latency: float
+        :param latency: base delay in seconds
+
+        :type jitter: float
+        :param jitter: max deviation of base delay in seconds
+
+        :type realtime_factor: float
+        :param realtime_factor: seconds of processing for one second of audio
+        """
+
+    def __init__(self, latency: float, jitter: float, realtime_factor: float):
+        self.latency = latency
+        self.jitter = jitter
+        self.realtime_factor = realtime_factor
+
+    def sleep(self, audio_seconds=0.0):
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)) +
+                   audio_seconds * self.realtime_factor)
+
+
+def synthetic_call(file_name: str, duration: float, channels=1, sample_rate=8000, seed=0):
+    """
+    Write WAV file with call-like audio: tone bursts of 0.5-4 s with random pitch separated by 0.3-1.5 s of silence.
+    In multichannel file speakers take turns on their channels
+    """
+    rnd = random.Random(seed)
+    total = int(duration * sample_rate)
+    tracks = [array('h', bytes(total * SAMPLE_WIDTH)) for _ in range(channels)]
+
+    position = rnd.uniform(0.1, 0.5)
+    speaker = 0
+    while position < duration:
+        length = rnd.uniform(0.5, 4.0)
+        step = 2 * math.pi * rnd.uniform(120, 300) / sample_rate
+        track = tracks[speaker]
+        for sample in range(int(position * sample_rate), min(total, int((position + length) * sample_rate))):
+            track[sample] = int(8000 * math.sin(step * sample))
+
+        position += length + rnd.uniform(0.3, 1.5)
+        speaker = (speaker + 1) % channels
+
+    if channels == 1:
+        samples = tracks[0]
+    else:
+        samples = array('h', bytes(total * channels * SAMPLE_WIDTH))
+        for channel, track in enumerate(tracks):
+            samples[channel::channels] = track
+
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    write_wav(file_name, samples.tobytes(), sample_rate, channels)
+
+
+def make_files(dir_name: str, count: int, durations: list, channels: list):
+    """
+    :return: list of synthetic files with all combinations of duration and count of channels
+    :rtype: list
+    """
+    files = []
+    for index in range(count):
+        duration = durations[index % len(durations)]
+        channel_count = channels[(index // len(durations)) % len(channels)]
+        file_name = os.path.join(dir_name, 'call_{0!s}_{1!s}s_{2!s}ch.wav'.format(index, duration, channel_count))
+        synthetic_call(file_name, duration, channel_count, seed=index)
+        files.append(file_name)
+
+    return files
+
+
+def start_yandex_server(latency: Latency):
+    """
+    Start fake SpeechKit service on random local port
+    :return: grpc server and its address
+    """
+    import grpc
+    import lib.ysk.stt_service_pb2 as stt_service_pb2
+    import lib.ysk.stt_service_pb2_grpc as stt_service_pb2_grpc
+
+    class FakeSttServicer(stt_service_pb2_grpc.SttServiceServicer):
+
+        def StreamingRecognize(self, request_iterator, context):
+            sample_rate = 8000
+            audio_bytes = 0
+            for request in request_iterator:
+                if request.HasField('config'):
+                    sample_rate = request.config.specification.sample_rate_hertz or sample_rate
+                else:
+                    audio_bytes += len(request.audio_content)
+
+            latency.sleep(audio_bytes / float(SAMPLE_WIDTH * sample_rate))
+
+            for final in (False, True):
+                yield stt_service_pb2.StreamingRecognitionResponse(chunks=[stt_service_pb2.SpeechRecognitionChunk(
+                    alternatives=[stt_service_pb2.SpeechRecognitionAlternative(text=FAKE_TEXT, confidence=1.0)],
+                    final=final)])
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=64))
+    stt_service_pb2_grpc.add_SttServiceServicer_to_server(FakeSttServicer(), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+
+    return server, '127.0.0.1:' + str(port)
+
+
+def start_wit_server(latency: Latency):
+    """
+    Start fake Wit speech endpoint on random local port
+    :return: http server and endpoint URL
+    """
+
+    class FakeWitHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            audio = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            latency.sleep(len(audio) / float(SAMPLE_WIDTH * WitASR.sample_rate_hertz))
+
+            body = json.dumps({'_text': FAKE_TEXT}).encode("utf-8")
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    class FakeWitServer(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    server = FakeWitServer(('127.0.0.1', 0), FakeWitHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server, 'http://127.0.0.1:{0!s}/speech'.format(server.server_address[1])
+
+
+class FakeStorageUploader(object):
+    """GCS stand-in with the interface of GoogleStorageUploader. Upload takes time proportional to file size
+    """
+    BUCKET = 'benchmark'
+
+    def __init__(self, latency: Latency, bandwidth: float):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.sizes = {}
+
+    def upload_file(self, file_path: str):
+        size = os.path.getsize(file_path)
+        self.latency.sleep()
+        time.sleep(size / self.bandwidth)
+
+        name = 'audio/' + os.path.basename(file_path)
+        self.sizes[name] = size
+        return SimpleNamespace(name=name, bucket=SimpleNamespace(name=self.BUCKET))
+
+    def release_file(self, blob):
+        self.sizes.pop(blob.name, None)
+
+
+class FakeSpeechClient(object):
+    """Google SpeechClient stand-in. Long running operation is done after latency of whole audio,
+    streaming recognition answers after every request is received
+    """
+
+    def __init__(self, latency: Latency, uploader: FakeStorageUploader):
+        self.latency = latency
+        self.uploader = uploader
+
+    @staticmethod
+    def response(is_final=True):
+        alternative = SimpleNamespace(transcript=FAKE_TEXT, words=[], confidence=1.0)
+        return SimpleNamespace(alternatives=[alternative], is_final=is_final, channel_tag=1)
+
+    def long_running_recognize(self, config, audio):
+        if isinstance(audio, dict):
+            size = self.uploader.sizes.get(audio['uri'].split('/', 3)[-1], 0)
+        else:
+            size = len(audio.content)
+        audio_seconds = size / float(SAMPLE_WIDTH * max(1, config.sample_rate_hertz) *
+                                     max(1, config.audio_channel_count))
+
+        started = time.time()
+        client = self
+
+        class FakeOperation(object):
+
+            def done(self):
+                return time.time() - started >= client.latency.latency + audio_seconds * client.latency.realtime_factor
+
+            def result(self, timeout=None):
+                client.latency.sleep(audio_seconds)
+                return SimpleNamespace(results=[client.response()])
+
+        return FakeOperation()
+
+    def streaming_recognize(self, streaming_config, requests):
+        size = sum(len(request.audio_content) for request in requests)
+        config = streaming_config.config
+        self.latency.sleep(size / float(SAMPLE_WIDTH * max(1, config.sample_rate_hertz)))
+
+        yield SimpleNamespace(error=SimpleNamespace(code=0, message=''), results=[self.response()])
+
+
+class FakeTokenProvider(object):
+
+    def get_token(self):
+        return 'benchmark'
+
+
+def configure(method_name: str, args):
+    """
+    Point provider config to local fakes
+    :return: function, which stops fake servers
+    """
+    from lib.recognizers import get_shared_client
+
+    latency = Latency(float(args.latency), float(args.jitter), float(args.realtime_factor))
+    GlobalConfig.demux_channels = args.demux
+
+    if method_name == 'yandex':
+        from lib.ysk.stt_lib import YandexSTT
+
+        server, address = start_yandex_server(latency)
+        YandexSTT.ENDPOINT = address
+        YandexSTT.USE_SSL = False
+        YandexASR.folder_id = 'benchmark'
+        YandexASR.variables_loaded = True
+        get_shared_client('yandex_iam', FakeTokenProvider)
+        return lambda: server.stop(0)
+
+    if method_name == 'wit':
+        server, endpoint = start_wit_server(latency)
+        WitASR.API_ENDPOINT = endpoint
+        WitASR.access_token = 'benchmark'
+        WitASR.variables_loaded = True
+        return server.shutdown
+
+    if method_name == 'google':
+        GoogleASR.project_name = 'benchmark'
+        GoogleASR.api_data = {'project_id': 'benchmark'}
+        GoogleASR.variables_loaded = True
+        uploader = get_shared_client('google_storage', lambda: FakeStorageUploader(latency, float(args.bandwidth)))
+        get_shared_client('google_speech', lambda: FakeSpeechClient(latency, uploader))
+        return lambda: None
+
+    raise ValueError('Unknown method ' + method_name)
+
+
+def percentiles(values: list):
+    """
+    :return: p50, p90, p99 and max of values
+    :rtype: dict
+    """
+    values = sorted(values)
+    if not values:
+        return {}
+
+    def percentile(share):
+        return round(values[min(len(values) - 1, int(math.ceil(share * len(values))) - 1)], 6)
+
+    return {'count': len(values), 'p50': percentile(0.5), 'p90': percentile(0.9), 'p99': percentile(0.99),
+            'max': round(values[-1], 6)}
+
+
+def peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def run_method(method_name: str, files: list, args):
+    """
+    Recognize files through worker pool with fake provider
+    :rtype: dict
+    """
+    from lib.recognizers import recognize
+
+    stop = configure(method_name, args)
+
+    def recognize_file(file_name):
+        with metrics.trace() as job_trace:
+            try:
+                result = recognize(file_name, method_name)
+            except (Exception, SystemExit) as err:
+                result = {'error': str(err)}
+        return result, job_trace.to_dict()
+
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=max(1, int(args.workers))) as executor:
+            jobs = list(executor.map(recognize_file, files))
+        wall_time = time.perf_counter() - started
+    finally:
+        stop()
+
+    stages = {}
+    for result, timings in jobs:
+        stages.setdefault('file', []).append(timings['total_seconds'])
+        for span in timings['spans']:
+            stages.setdefault(span['stage'], []).append(span['duration'])
+
+    errors = [result for result, timings in jobs if isinstance(result, dict) and 'error' in result]
+
+    return {
+        'method': method_name,
+        'files': len(files),
+        'errors': len(errors),
+        'first_error': errors[0]['error'] if errors else None,
+        'wall_time': round(wall_time, 4),
+        'files_per_second': round(len(files) / wall_time, 4) if wall_time else None,
+        'stages': {stage: percentiles(values) for stage, values in sorted(stages.items())},
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+
+def run_hot_paths(files: list, args):
+    """
+    Measure functions, which process every byte of audio, without any provider
+    :rtype: dict
+    """
+    from lib.audio import decode_pcm
+    from lib.recognizers import split_pcm, split_by_ffmpeg
+
+    def measure(func, *func_args):
+        times = []
+        for _ in range(int(args.runs)):
+            started = time.perf_counter()
+            func(*func_args)
+            times.append(time.perf_counter() - started)
+        return percentiles(times)
+
+    file_name = max(files, key=os.path.getsize)
+    pcm = decode_pcm(file_name, YandexASR.sample_rate_hertz)
+    audio_seconds = len(pcm) / float(SAMPLE_WIDTH * YandexASR.sample_rate_hertz)
+
+    stages = {
+        'split_pcm': measure(split_pcm, pcm, YandexASR.sample_rate_hertz),
+        'split_by_ffmpeg': measure(lambda: [os.remove(part['file_name']) for part in
+                                            split_by_ffmpeg(file_name, single_pass=False)])
+    }
+
+    try:
+        from lib.ysk.stt_lib import YandexSTT
+
+        stages['yandex_gen'] = measure(lambda: sum(1 for _ in YandexSTT.gen(
+            'benchmark', pcm, 'ru-RU', 'LINEAR16_PCM', YandexASR.sample_rate_hertz)))
+    except ImportError as err:
+        stages['yandex_gen'] = {'error': str(err)}
+
+    return {
+        'method': 'hot_paths',
+        'file': os.path.basename(file_name),
+        'audio_seconds': round(audio_seconds, 3),
+        'stages': stages,
+        'peak_rss_bytes': peak_rss_bytes()
+    }
+
+
+def child_arguments(args):
+    """
+    Repeat command line options (except methods) for run of one method
+    :rtype: list
+    """
+    arguments = ['--' + name.replace('_', '-') + '=' + str(value) for name, value in sorted(vars(args).items())
+                 if name not in ('methods', 'in_process', 'demux')]
+    if args.demux:
+        arguments.append('--demux')
+
+    return arguments
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure recognition throughput against local fake providers')
+    parser.add_argument('--method', '-m', dest='methods', action='append',
+                        help='Method to measure (google, yandex, wit, hot_paths), default all')
+    parser.add_argument('--files', '-f', dest='files', default='20', help='Count of synthetic files, default 20')
+    parser.add_argument('--durations', dest='durations', default='10,60,300',
+                        help='Comma separated durations of files in seconds, default 10,60,300')
+    parser.add_argument('--channels', dest='channels', default='1,2',
+                        help='Comma separated counts of channels of files, default 1,2')
+    parser.add_argument('--demux', dest='demux', action='store_true', help='Recognize channels separately')
+    parser.add_argument('--workers', '-w', dest='workers', default='4', help='Count of concurrent files, default 4')
+    parser.add_argument('--latency', dest='latency', default='0.1', help='Base answer delay in seconds, default 0.1')
+    parser.add_argument('--jitter', dest='jitter', default='0.02', help='Max deviation of delay, default 0.02')
+    parser.add_argument('--realtime-factor', dest='realtime_factor', default='0.01',
+                        help='Seconds of processing per second of audio, default 0.01')
+    parser.add_argument('--bandwidth', dest='bandwidth', default=str(50 * 1024 * 1024),
+                        help='Fake GCS upload speed in bytes per second, default 50 MB/s')
+    parser.add_argument('--runs', '-r', dest='runs', default='5', help='Count of runs for hot paths, default 5')
+    parser.add_argument('--in-process', dest='in_process', action='store_true',
+                        help='Run the only method in this process instead of fresh interpreter')
+    args = parser.parse_args()
+
+    methods = args.methods or list(METHODS)
+
+    if not args.in_process:
+        for method_name in methods:
+            command = [sys.executable, os.path.realpath(__file__), '--in-process', '--method', method_name] + \
+                      child_arguments(args)
+            proc = subprocess.Popen(command, cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            out, err = proc.communicate()
+            if proc.returncode != 0:
+                lines = err.decode("utf-8", "replace").strip().split("\n")
+                print(json.dumps({'method': method_name, 'error': lines[-1]}))
+            else:
+                sys.stdout.write(out.decode("utf-8"))
+            sys.stdout.flush()
+        return
+
+    with tempfile.TemporaryDirectory(prefix='recognizer_benchmark_') as dir_name:
+        files = make_files(dir_name, int(args.files), [float(value) for value in args.durations.split(',')],
+                           [int(value) for value in args.channels.split(',')])
+
+        for method_name in methods:
+            if method_name == 'hot_paths':
+                report = run_hot_paths(files, args)
+            else:
+                report = run_method(method_name, files, args)
+            print(json.dumps(report), flush=True)
+
+
+if __name__ == "__main__":
+    main()
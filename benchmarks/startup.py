@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cold start benchmark. Measures import time of recognizer modules and provider libraries for every method
+with "python -X importtime" in fresh interpreters.
+
+    $ python benchmarks/startup.py --runs=5
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + "/..")
+
+# Modules, which are imported when recognition with method is started
+METHOD_IMPORTS = {
+    'none': "import lib.recognizers",
+    'google': "import lib.recognizers; from lib.credentials import GoogleASR; GoogleASR.get_libs(); "
+              "import lib.google_streaming",
+    'yandex': "import lib.recognizers; import lib.ysk.stt_lib",
+    'wit': "import lib.recognizers; import requests",
+}
+
+
+def measure(statement: str):
+    """
+    Run statement in fresh interpreter
+    :return: wall time in seconds and cumulative import time in seconds (or None, if imports failed)
+    :rtype: tuple
+    """
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT_DIR,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    wall_time = time.perf_counter() - started
+
+    if proc.returncode != 0:
+        return wall_time, None
+
+    import_time = 0
+    for line in err.decode("utf-8", "replace").split("\n"):
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Only top level imports, nested ones are included in cumulative time
+        if not name[1:].startswith(' '):
+            import_time += int(cumulative_us)
+
+    return wall_time, import_time / 1000000.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold start of recognizer for every method')
+    parser.add_argument('--runs', '-r', dest='runs', default='5', help='Count of runs for every method, default 5')
+    parser.add_argument('--method', '-m', dest='methods', action='append',
+                        help='Method to measure (none, google, yandex, wit), default all')
+    args = parser.parse_args()
+
+    for method_name in args.methods or sorted(METHOD_IMPORTS):
+        wall_times = []
+        import_times = []
+        for _ in range(int(args.runs)):
+            wall_time, import_time = measure(METHOD_IMPORTS[method_name])
+            wall_times.append(wall_time)
+            if import_time is not None:
+                import_times.append(import_time)
+
+        print(json.dumps({
+            'method': method_name,
+            'wall_time_median': round(statistics.median(wall_times), 4),
+            'import_time_median': round(statistics.median(import_times), 4) if import_times else None,
+            'error': None if import_times else 'Provider libraries are not installed'
+        }))
+
+
+if __name__ == "__main__":
+    main()
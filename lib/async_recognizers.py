@@ -0,0 +1,446 @@
+import os
+import errno
+import asyncio
+import weakref
+from functools import partial
+
+import grpc
+
+from .credentials import GlobalConfig, GoogleASR, YandexASR, WitASR, HttpConfig, CredentialsError
+from . import metrics
+from .limits import get_limiter, QuotaError
+from .audio import pcm_decode_command, iter_wav_pcm
+from .cache import ResultCache
+from .probe import AudioProbe
+from .recognizers import get_result_cache, recognition_configs, get_google_uploader, google_recognition_setup, \
+    google_recognition_audio, google_response_to_strings, google_streaming_results, google_result_to_object, \
+    get_yandex_iam, split_pcm, audio_parts_to_strings, read_audio, wit_request_headers, wit_content_result, \
+    type_wit_chunked, recognize_channels, is_good_result, wit_post
+from .ysk.stt_lib import YandexSTT
+import lib.ysk.stt_service_pb2_grpc as stt_service_pb2_grpc
+
+try:
+    from grpc import aio as grpc_aio
+except ImportError:
+    grpc_aio = None
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+async def run_blocking(func, *args, **kwargs):
+    """
+    Run blocking call in default executor of the running loop
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, partial(metrics.bind(func), *args, **kwargs))
+
+
+async def decode_pcm_async(input_file: str, sample_rate=8000, channels=1):
+    """
+    Decode audio file into signed 16 bit PCM with asyncio subprocess
+    :rtype: bytes
+    """
+    with metrics.span('decode') as attributes:
+        proc = await asyncio.create_subprocess_exec(*pcm_decode_command(input_file, sample_rate, channels),
+                                                    stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        out, err = await proc.communicate()
+        attributes['bytes'] = len(out)
+
+    if proc.returncode != 0:
+        raise IOError("ffmpeg can't decode file " + input_file + ": " + err.decode("utf-8", "replace").strip())
+
+    metrics.count('decoded_bytes', len(out))
+    return out
+
+
+async def prepare_yandex_audio(file_name: str):
+    """
+    Choose encoding of file like YandexSTT.prepare_audio, but audio is probed and read in executor and decoded
+    with asyncio subprocess, so grpc.aio, which iterates requests in event loop, doesn't wait for ffmpeg
+    :return: audio bytes, audio encoding and sample rate
+    :rtype: tuple
+    """
+    audio_info = await run_blocking(AudioProbe.get_info, file_name)
+
+    if audio_info.codec == 'opus' and audio_info.mime in ('audio/ogg', 'video/ogg'):
+        return await run_blocking(read_audio, file_name), 'OGG_OPUS', 48000
+
+    sample_rate = YandexSTT.supported_sample_rate(audio_info.frame_rate)
+
+    if audio_info.codec == 'pcm_s16le' and audio_info.channels == 1 and audio_info.frame_rate == sample_rate:
+        pcm = await run_blocking(lambda: b''.join(iter_wav_pcm(file_name, YandexSTT.CHUNK_SIZE)))
+        return pcm, 'LINEAR16_PCM', sample_rate
+
+    return await decode_pcm_async(file_name, sample_rate), 'LINEAR16_PCM', sample_rate
+
+
+class AsyncProvider(object):
+    """Base class of provider adapter. Count of simultaneous recognitions is limited by
+    max_concurrent_recognitions of provider config.
+    """
+    config = GlobalConfig
+
+    def __init__(self):
+        self._semaphore = None
+
+    @property
+    def semaphore(self):
+        # Semaphore is created inside running loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(max(1, self.config.max_concurrent_recognitions))
+        return self._semaphore
+
+    async def recognize(self, file_name: str):
+        async with self.semaphore:
+            return await self.recognize_file(file_name)
+
+    async def recognize_file(self, file_name: str):
+        raise NotImplementedError()
+
+    async def aclose(self):
+        """
+        Close channels and sessions of provider
+        """
+        pass
+
+
+class AsyncGoogleProvider(AsyncProvider):
+    """Google Speech-To-Text adapter. Google client library has no asyncio API, so blocking requests are run in
+    executor and long running operation is polled without holding a thread between polls.
+    """
+    config = GoogleASR
+
+    async def recognize_file(self, file_name: str):
+        setup = await run_blocking(google_recognition_setup, file_name)
+        if 'error' in setup:
+            return setup
+
+        client = setup['client']
+        types = setup['types']
+        config = setup['config']
+        audio_info = setup['audio_info']
+        file_name = setup['file_name']
+
+        try:
+            if GoogleASR.streaming and audio_info.duration_seconds <= GoogleASR.streaming_max_duration:
+                with metrics.span('streaming', bytes=os.path.getsize(file_name)):
+                    return await run_blocking(get_limiter('google', GoogleASR).call,
+                                              lambda: [google_result_to_object(result) for result in
+                                                       google_streaming_results(client, types, config, file_name)])
+
+            audio, blob = await run_blocking(google_recognition_audio, file_name, types, audio_info)
+
+            try:
+                with metrics.span('operation_start'):
+                    operation = await run_blocking(get_limiter('google', GoogleASR).call,
+                                                   client.long_running_recognize, config, audio)
+
+                loop = asyncio.get_event_loop()
+                deadline = loop.time() + GoogleASR.operation_timeout
+                with metrics.span('operation_wait'):
+                    while not await run_blocking(operation.done):
+                        if loop.time() > deadline:
+                            return {'error': 'Recognition operation timed out'}
+                        await asyncio.sleep(GoogleASR.poll_interval)
+
+                response = operation.result()
+            finally:
+                if blob:
+                    await run_blocking(get_google_uploader().release_file, blob)
+        finally:
+            if setup['temp_file']:
+                os.remove(setup['temp_file'])
+
+        return google_response_to_strings(response)
+
+
+class AsyncYandexProvider(AsyncProvider):
+    """Yandex SpeechKit adapter. Audio is decoded with asyncio subprocess and parts are streamed over grpc.aio
+    channel (or over shared blocking channel in executor, if grpc.aio isn't available).
+    """
+    config = YandexASR
+
+    def __init__(self):
+        super(AsyncYandexProvider, self).__init__()
+        self._channel = None
+
+    @property
+    def channel(self):
+        if self._channel is None:
+            if YandexSTT.USE_SSL:
+                self._channel = grpc_aio.secure_channel(YandexSTT.ENDPOINT, grpc.ssl_channel_credentials())
+            else:
+                self._channel = grpc_aio.insecure_channel(YandexSTT.ENDPOINT)
+        return self._channel
+
+    async def aclose(self):
+        if self._channel is not None:
+            channel, self._channel = self._channel, None
+            await channel.close()
+
+    async def recognize_file(self, file_name: str):
+        try:
+            iam_key = await run_blocking(get_yandex_iam)
+        except IOError as err:
+            return {'error': str(err)}
+        file = os.path.abspath(file_name)
+
+        if YandexASR.split_by_silence:
+            pcm = await decode_pcm_async(file, YandexASR.sample_rate_hertz)
+            audio_parts = await run_blocking(split_pcm, pcm, YandexASR.sample_rate_hertz, YandexASR)
+        else:
+            audio_parts = [{
+                "index": 1,
+                "file_name": file,
+                "start": 0
+            }]
+
+        streams = asyncio.Semaphore(max(1, YandexASR.max_concurrent_streams))
+        texts = await asyncio.gather(*[self.recognize_part(audio_file, iam_key, streams)
+                                       for audio_file in audio_parts])
+
+        errors = [text for text in texts if isinstance(text, dict)]
+        if errors:
+            return errors[0]
+
+        return audio_parts_to_strings(audio_parts, texts)
+
+    async def recognize_part(self, audio_file: dict, iam_key: str, streams: asyncio.Semaphore):
+        if 'audio' in audio_file:
+            audio = audio_file['audio']
+            audio_encoding = 'LINEAR16_PCM'
+            sample_rate_hertz = YandexASR.sample_rate_hertz
+        else:
+            audio = audio_file['file_name']
+            audio_encoding = None
+            sample_rate_hertz = None
+
+        limiter = get_limiter('yandex', YandexASR)
+
+        async with streams:
+            try:
+                if grpc_aio is not None and audio_encoding is None:
+                    audio, audio_encoding, sample_rate_hertz = await prepare_yandex_audio(audio)
+
+                with metrics.span('streaming', part=audio_file['index']):
+                    if grpc_aio is None:
+                        return await run_blocking(limiter.call, YandexSTT.run, YandexASR.folder_id, iam_key, audio,
+                                                  YandexASR.language_code, None, audio_encoding, sample_rate_hertz)
+
+                    return await limiter.call_async(self.stream_part, audio, iam_key, audio_encoding,
+                                                    sample_rate_hertz)
+            except Exception as err:
+                return {'error': "Caught error \"{0!s}\" in Yandex recognition of part {1!s}".format(
+                    err, audio_file['index'])}
+
+    async def stream_part(self, audio, iam_key: str, audio_encoding, sample_rate_hertz):
+        stub = stt_service_pb2_grpc.SttServiceStub(self.channel)
+        requests_iterator = YandexSTT.gen(YandexASR.folder_id, audio, YandexASR.language_code, audio_encoding,
+                                          sample_rate_hertz)
+        call = stub.StreamingRecognize(requests_iterator,
+                                       metadata=(('authorization', 'Bearer %s' % iam_key),))
+
+        strings_answer = []
+        async for r in call:
+            if r.chunks and r.chunks[0].final and r.chunks[0].alternatives:
+                strings_answer.append(r.chunks[0].alternatives[0].text)
+
+        return "\n".join(strings_answer)
+
+
+class AsyncWitProvider(AsyncProvider):
+    """Wit.ai adapter. Requests are sent with aiohttp (or with requests in executor, if aiohttp isn't installed).
+    """
+    config = WitASR
+
+    def __init__(self):
+        super(AsyncWitProvider, self).__init__()
+        self._session = None
+
+    async def recognize_file(self, file_name: str):
+        WitASR.load_variables()
+
+        file_name = os.path.abspath(file_name)
+        audio_info = await run_blocking(AudioProbe.get_info, file_name)
+        if audio_info.duration_seconds > WitASR.max_duration:
+            return await run_blocking(type_wit_chunked, file_name)
+
+        headers = wit_request_headers(audio_info)
+        if 'error' in headers:
+            return headers
+
+        audio = await run_blocking(read_audio, file_name)
+
+        if aiohttp is None:
+            content = await run_blocking(get_limiter('wit', WitASR).call, wit_post, headers, audio)
+        else:
+            content = await get_limiter('wit', WitASR).call_async(self.post, headers, audio)
+
+        return wit_content_result(content)
+
+    async def post(self, headers: dict, audio: bytes):
+        if self._session is None:
+            # The same timeout and connection limit as blocking sessions of lib.sessions
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=HttpConfig.timeout),
+                connector=aiohttp.TCPConnector(limit_per_host=HttpConfig.pool_maxsize))
+
+        with metrics.span('request', bytes=len(audio)):
+            async with self._session.post(WitASR.API_ENDPOINT, headers=headers, data=audio) as resp:
+                if resp.status == 429:
+                    retry_after = resp.headers.get('Retry-After')
+                    raise QuotaError('Wit rate limit is exceeded',
+                                     float(retry_after) if retry_after and retry_after.isdigit() else None)
+                content = await resp.text()
+
+        metrics.count('sent_bytes', len(audio))
+        return content
+
+    async def aclose(self):
+        if self._session is not None:
+            session, self._session = self._session, None
+            await session.close()
+
+
+class AsyncRecognizer(object):
+    """Asyncio recognition core. One instance should be used inside one event loop.
+    """
+
+    def __init__(self):
+        self.providers = {
+            'yandex': AsyncYandexProvider(),
+            'google': AsyncGoogleProvider(),
+            'wit': AsyncWitProvider()
+        }
+
+    async def recognize(self, file_name, method_name):
+        try:
+            file_object = os.path.abspath(file_name)
+            if not os.path.isfile(file_object):
+                raise IOError(errno.ENOENT, "File doesn't exists", file_object)
+        except IOError as err:
+            return {'error': "Caught error \"" + err.strerror + "\" in file " + err.filename}
+
+        methods = [type_name.strip() for type_name in method_name.split(',')]
+
+        if not all(type_name in self.providers for type_name in methods):
+            return {'error': 'Unknown recognition method'}
+
+        if len(methods) > 1:
+            return await self.recognize_multi(file_object, methods)
+
+        return await self.recognize_method(file_object, methods[0])
+
+    async def aclose(self):
+        """
+        Close gRPC channel and HTTP session of providers. Recognizer can be used again, they are reopened on demand
+        """
+        for provider in self.providers.values():
+            await provider.aclose()
+
+    async def recognize_method(self, file_object, method_name):
+        with metrics.provider(method_name), metrics.span('recognition', bytes=os.path.getsize(file_object)):
+            cache = get_result_cache()
+            if cache:
+                with metrics.span('cache_lookup'):
+                    cache_key = await run_blocking(ResultCache.make_key, file_object, method_name,
+                                                   recognition_configs[method_name].get_settings())
+                    cached_result = await run_blocking(cache.get, cache_key)
+                if cached_result:
+                    metrics.count('cache_hits')
+                    return cached_result
+
+            metrics.count('recognitions')
+            try:
+                if GlobalConfig.demux_channels:
+                    result = await run_blocking(recognize_channels, file_object, method_name)
+                else:
+                    result = await self.providers[method_name].recognize(file_object)
+            except CredentialsError as err:
+                result = {'error': str(err)}
+            if not result:
+                metrics.count('recognition_errors')
+                return {'error': 'Empty result was returned'}
+
+            if not is_good_result(result):
+                metrics.count('recognition_errors')
+            elif cache:
+                await run_blocking(cache.put, cache_key, result)
+
+            return result
+
+    async def recognize_method_safe(self, file_object, method_name):
+        try:
+            return await self.recognize_method(file_object, method_name)
+        except (Exception, SystemExit) as err:
+            return {'error': "Caught error \"{0!s}\" in {1!s} recognition".format(err, method_name)}
+
+    async def recognize_multi(self, file_object, methods):
+        """
+        The same as lib.recognizers.recognize_multi, but methods, which are still running, are cancelled
+        """
+        if GlobalConfig.multi_method_mode == 'fallback':
+            result = None
+            for method_name in methods:
+                result = await self.recognize_method_safe(file_object, method_name)
+                if is_good_result(result):
+                    return result
+            return result
+
+        delay = 0 if GlobalConfig.multi_method_mode == 'race' else GlobalConfig.hedge_delay
+        tasks = set()
+        next_method = 0
+        result = {'error': 'Empty result was returned'}
+
+        try:
+            while True:
+                while next_method < len(methods):
+                    tasks.add(asyncio.ensure_future(self.recognize_method_safe(file_object, methods[next_method])))
+                    next_method += 1
+                    if delay > 0:
+                        break
+
+                if not tasks:
+                    break
+
+                timeout = delay if delay > 0 and next_method < len(methods) else None
+                done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    result = task.result()
+                    if is_good_result(result):
+                        return result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+        return result
+
+
+_recognizers = weakref.WeakKeyDictionary()
+
+
+async def recognize(file_name, method_name):
+    """
+    Recognize file without blocking event loop. Providers keep their channels and sessions per event loop
+    :param file_name: path to media file
+    :param method_name: recognition method (google, yandex, wit)
+    :return: the same result as lib.recognizers.recognize
+    """
+    loop = asyncio.get_event_loop()
+    if loop not in _recognizers:
+        _recognizers[loop] = AsyncRecognizer()
+
+    return await _recognizers[loop].recognize(file_name, method_name)
+
+
+async def aclose():
+    """
+    Close channels and sessions, which are kept by recognize for the running event loop
+    """
+    recognizer = _recognizers.pop(asyncio.get_event_loop(), None)
+    if recognizer is not None:
+        await recognizer.aclose()
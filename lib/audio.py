@@ -0,0 +1,140 @@
+import io
+import wave
+import tempfile
+import subprocess
+
+from . import metrics
+
+SAMPLE_WIDTH = 2
+
+
+def pcm_decode_command(input_file: str, sample_rate=8000, channels=1):
+    """
+    Get ffmpeg command, which writes signed 16 bit little-endian PCM of input file to stdout
+    :rtype: list
+    """
+    return [
+        r'ffmpeg',
+        '-v', 'error',
+        '-i', input_file,
+        '-f', 's16le',
+        '-acodec', 'pcm_s16le',
+        '-ac', str(channels),
+        '-ar', str(sample_rate),
+        '-'
+    ]
+
+
+def decode_pcm(input_file: str, sample_rate=8000, channels=1):
+    """
+    Decode audio file once into signed 16 bit little-endian PCM
+    :param input_file: path to media file
+    :param sample_rate: output sample rate
+    :param channels: output count of channels
+    :return: raw PCM bytes
+    :rtype: bytes
+    """
+    decode_command = pcm_decode_command(input_file, sample_rate, channels)
+
+    with metrics.span('decode') as attributes:
+        proc = subprocess.Popen(decode_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+        attributes['bytes'] = len(out)
+
+    if proc.returncode != 0:
+        raise IOError("ffmpeg can't decode file " + input_file + ": " + err.decode("utf-8", "replace").strip())
+
+    metrics.count('decoded_bytes', len(out))
+    return out
+
+
+def iter_chunks(audio, chunk_size: int):
+    """
+    Read audio by chunk_size pieces
+    :param audio: path to file, bytes-like object (memoryview slices aren't copied until they are read),
+                  file-like object or iterable of bytes
+    :param chunk_size: size of piece in bytes
+    :return: generator of bytes
+    """
+    if isinstance(audio, str):
+        with open(audio, 'rb') as f:
+            for data in iter_chunks(f, chunk_size):
+                yield data
+    elif isinstance(audio, (bytes, bytearray, memoryview)):
+        view = memoryview(audio)
+        for offset in range(0, len(view), chunk_size):
+            yield bytes(view[offset:offset + chunk_size])
+    elif hasattr(audio, 'read'):
+        data = audio.read(chunk_size)
+        while data:
+            yield data
+            data = audio.read(chunk_size)
+    else:
+        for data in audio:
+            if data:
+                yield bytes(data)
+
+
+def iter_wav_pcm(file_name: str, chunk_size: int):
+    """
+    Read PCM frames of WAV file without header
+    :return: generator of bytes
+    """
+    with wave.open(file_name, 'rb') as wav:
+        frames = max(1, chunk_size // (wav.getsampwidth() * wav.getnchannels()))
+        data = wav.readframes(frames)
+        while data:
+            yield data
+            data = wav.readframes(frames)
+
+
+def iter_decoded_pcm(input_file: str, chunk_size: int, sample_rate=8000, channels=1):
+    """
+    Decode and resample file with ffmpeg and read PCM while it is being decoded
+    :return: generator of signed 16 bit PCM bytes
+    :raises IOError: if ffmpeg fails, after PCM decoded before the failure is read
+    """
+    # stderr is written to temp file, so ffmpeg doesn't block on full pipe while stdout is read
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(pcm_decode_command(input_file, sample_rate, channels),
+                                stdout=subprocess.PIPE, stderr=errors)
+        finished = False
+        try:
+            data = proc.stdout.read(chunk_size)
+            while data:
+                yield data
+                data = proc.stdout.read(chunk_size)
+            finished = True
+        finally:
+            # Decoding is stopped, if PCM isn't read to the end
+            if not finished and proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            proc.wait()
+
+        if proc.returncode != 0:
+            errors.seek(0)
+            raise IOError("ffmpeg can't decode file " + input_file + ": " +
+                          errors.read().decode("utf-8", "replace").strip())
+
+
+def write_wav(file_name, pcm, sample_rate: int, channels=1):
+    """
+    Write signed 16 bit PCM into WAV file
+    :param file_name: path to file or file-like object
+    """
+    with wave.open(file_name, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(SAMPLE_WIDTH)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+
+
+def wav_bytes(pcm, sample_rate: int, channels=1):
+    """
+    Wrap signed 16 bit PCM into in-memory WAV
+    :rtype: bytes
+    """
+    wav = io.BytesIO()
+    write_wav(wav, pcm, sample_rate, channels)
+    return wav.getvalue()
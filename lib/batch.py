@@ -0,0 +1,130 @@
+import os
+import sys
+import glob
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from . import metrics
+from .credentials import MetricsConfig, CredentialsError
+from .recognizers import recognize, recognition_configs
+
+
+def collect_files(source: str, method_name: str):
+    """
+    Build list of jobs from directory, glob pattern or JSONL manifest
+    :param source: directory path, glob pattern or path to JSONL manifest
+    :param method_name: default recognition method for every job
+    :return: list of dicts with "file" and "method" keys
+    :rtype: list
+    """
+    if os.path.isdir(source):
+        files = []
+        for root, dirs, names in os.walk(source):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            files.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith('.'))
+        return [{'file': file, 'method': method_name} for file in files]
+
+    if os.path.isfile(source) and source.endswith('.jsonl'):
+        return read_manifest(source, method_name)
+
+    return [{'file': file, 'method': method_name}
+            for file in sorted(glob.glob(source, recursive=True)) if os.path.isfile(file)]
+
+
+def read_manifest(manifest_file: str, method_name: str):
+    """
+    Read JSONL manifest. Every line is a file path string or an object with "file" and optional "method" keys.
+    Malformed line becomes a job with "error" key, so it gets an error result instead of aborting the batch
+    :param manifest_file: path to manifest
+    :param method_name: recognition method for lines without "method" key
+    :return: list of dicts with "file" and "method" keys (or "line", "method" and "error" keys)
+    :rtype: list
+    """
+    jobs = []
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+
+    with open(manifest_file, 'r') as manifest:
+        for line_number, line in enumerate(manifest, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                entry = json.loads(line)
+                if isinstance(entry, str):
+                    entry = {'file': entry}
+                if not isinstance(entry, dict) or not isinstance(entry.get('file'), str):
+                    raise ValueError('line must be a file path or an object with "file" key')
+
+                job = dict(entry)
+                job['file'] = os.path.join(base_dir, entry['file'])
+                job.setdefault('method', method_name)
+            except ValueError as err:
+                job = {'line': line_number, 'method': method_name,
+                       'error': "Caught error \"{0!s}\" in line {1!s} of manifest {2!s}".format(
+                           err, line_number, manifest_file)}
+
+            jobs.append(job)
+
+    return jobs
+
+
+def recognize_job(job: dict):
+    """
+    Recognize single batch job. Errors are returned in the result line and never abort the batch.
+    If MetricsConfig.timings is set, spans of pipeline stages are added in "timings" key
+    :param job: dict with "file" and "method" keys
+    :rtype: dict
+    """
+    line = dict(job)
+    if 'error' in line:
+        line['result'] = {'error': line.pop('error')}
+        return line
+
+    with metrics.trace() as job_trace:
+        try:
+            line['result'] = recognize(job['file'], job['method'])
+        except (Exception, SystemExit) as err:
+            line['result'] = {'error': "Caught error \"{0!s}\" in file {1!s}".format(err, job['file'])}
+
+    if MetricsConfig.timings:
+        line['timings'] = job_trace.to_dict()
+
+    return line
+
+
+def run_batch(jobs: list, workers=4, output=None):
+    """
+    Recognize files through bounded worker pool and write one JSONL line per file as soon as it is finished
+    :param jobs: list of jobs from collect_files
+    :param workers: count of concurrent recognitions
+    :param output: file object for results, stdout by default
+    :return: count of files, which were finished with error
+    :rtype: int
+    """
+    output = output or sys.stdout
+    write_lock = threading.Lock()
+    errors = 0
+
+    # Credentials are loaded once here, not in every worker. If they are missing, every job of the method
+    # gets the error in its result line
+    for method_name in set(job['method'] for job in jobs):
+        if method_name in recognition_configs:
+            try:
+                recognition_configs[method_name].load_variables()
+            except CredentialsError:
+                pass
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        futures = [executor.submit(recognize_job, job) for job in jobs]
+
+        for future in as_completed(futures):
+            line = future.result()
+            if isinstance(line['result'], dict) and 'error' in line['result']:
+                errors += 1
+
+            with write_lock:
+                output.write(json.dumps(line) + "\n")
+                output.flush()
+
+    return errors
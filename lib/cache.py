@@ -0,0 +1,138 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class ResultCache(object):
+    """SQLite storage of recognition results, keyed by audio content hash and recognition settings.
+
+        :type file_name: str
+        :param file_name: path to SQLite database, it is created if it doesn't exist
+
+        :type max_entries: int
+        :param max_entries: count of stored results, least recently used are evicted first
+
+        :type max_size_bytes: int
+        :param max_size_bytes: total size of stored results in bytes
+
+        :type ttl_seconds: int
+        :param ttl_seconds: result lifetime, 0 means results never expire
+        """
+    HASH_CHUNK_SIZE = 1024 * 1024
+
+    _hashes = {}
+    _hashes_lock = threading.Lock()
+
+    def __init__(self, file_name: str, max_entries=100000, max_size_bytes=512 * 1024 * 1024, ttl_seconds=0):
+        self.file_name = os.path.abspath(file_name)
+        self.max_entries = max_entries
+        self.max_size_bytes = max_size_bytes
+        self.ttl_seconds = ttl_seconds
+
+        dir_name = os.path.dirname(self.file_name)
+        if not os.path.isdir(dir_name):
+            os.makedirs(dir_name, exist_ok=True)
+
+        with self.__connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS results ('
+                               'key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, '
+                               'created REAL NOT NULL, accessed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    @contextmanager
+    def __connect(self):
+        # Connection per operation, so cache can be shared by threads and processes
+        connection = sqlite3.connect(self.file_name, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @staticmethod
+    def file_hash(file_name: str):
+        """
+        Get SHA-256 of file content. Hashes are remembered by path, size and modification time
+        :rtype: str
+        """
+        stat = os.stat(file_name)
+        stat_key = (os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns)
+
+        with ResultCache._hashes_lock:
+            if stat_key in ResultCache._hashes:
+                return ResultCache._hashes[stat_key]
+
+        content_hash = hashlib.sha256()
+        with open(file_name, 'rb') as f:
+            data = f.read(ResultCache.HASH_CHUNK_SIZE)
+            while data:
+                content_hash.update(data)
+                data = f.read(ResultCache.HASH_CHUNK_SIZE)
+
+        with ResultCache._hashes_lock:
+            ResultCache._hashes[stat_key] = content_hash.hexdigest()
+
+        return content_hash.hexdigest()
+
+    @staticmethod
+    def make_key(file_name: str, method_name: str, settings: dict):
+        """
+        Build cache key from audio content and effective recognition settings
+        :rtype: str
+        """
+        settings_json = json.dumps({'method': method_name, 'settings': settings}, sort_keys=True)
+        return ResultCache.file_hash(file_name) + ':' + hashlib.sha256(settings_json.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        """
+        :return: stored result or None, if it is missing or expired
+        """
+        now = time.time()
+        with self.__connect() as connection:
+            row = connection.execute('SELECT result, created FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+
+            if self.ttl_seconds and row[1] + self.ttl_seconds < now:
+                connection.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+
+            connection.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+
+        return json.loads(row[0])
+
+    def put(self, key: str, result):
+        now = time.time()
+        result_json = json.dumps(result)
+
+        with self.__connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO results (key, result, size, created, accessed) '
+                               'VALUES (?, ?, ?, ?, ?)', (key, result_json, len(result_json), now, now))
+            self.__evict(connection, now)
+
+    def __evict(self, connection, now: float):
+        if self.ttl_seconds:
+            connection.execute('DELETE FROM results WHERE created < ?', (now - self.ttl_seconds,))
+
+        count, size = connection.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+
+        if count > self.max_entries:
+            connection.execute('DELETE FROM results WHERE key IN '
+                               '(SELECT key FROM results ORDER BY accessed LIMIT ?)', (count - self.max_entries,))
+            size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+        while size > self.max_size_bytes:
+            rows = connection.execute('SELECT key, size FROM results ORDER BY accessed LIMIT 100').fetchall()
+            if not rows:
+                break
+
+            for key, row_size in rows:
+                connection.execute('DELETE FROM results WHERE key = ?', (key,))
+                size -= row_size
+                if size <= self.max_size_bytes:
+                    break
@@ -0,0 +1,71 @@
+import sys
+from array import array
+
+from .audio import decode_pcm
+from .probe import AudioProbe
+
+
+def demux_channels(file_name: str):
+    """
+    Decode file once and split it into mono PCM of every channel
+    :param file_name: path to media file
+    :return: list of signed 16 bit mono PCM (one per channel) and sample rate
+    :rtype: tuple
+    """
+    audio_info = AudioProbe.get_info(file_name)
+    channels = max(1, audio_info.channels)
+    sample_rate = audio_info.frame_rate
+
+    pcm = decode_pcm(file_name, sample_rate, channels)
+    if channels == 1:
+        return [pcm], sample_rate
+
+    samples = array('h')
+    samples.frombytes(pcm[:len(pcm) - len(pcm) % (2 * channels)])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+
+    channels_pcm = []
+    for channel in range(channels):
+        channel_samples = samples[channel::channels]
+        if sys.byteorder == 'big':
+            channel_samples.byteswap()
+        channels_pcm.append(channel_samples.tobytes())
+
+    return channels_pcm, sample_rate
+
+
+def utterance_start_time(item):
+    """
+    Get start time of recognized utterance in seconds from any provider output
+    :rtype: float
+    """
+    if isinstance(item, dict):
+        if 'audio_part_start_time' in item:
+            return float(item['audio_part_start_time'])
+        if item.get('words'):
+            start_time = item['words'][0]['start_time']
+            return start_time['seconds'] + start_time['nanos'] / 1000000000.0
+    return 0.0
+
+
+def merge_channel_results(channel_results: list):
+    """
+    Merge results of channels into one time-ordered dialog
+    :param channel_results: provider outputs in order of channels
+    :return: list of utterances with "channel", "start_time" and "text" keys or dict with "error" key
+    """
+    utterances = []
+
+    for channel, result in enumerate(channel_results, 1):
+        if isinstance(result, dict):
+            return {'error': "Channel {0!s}: {1!s}".format(channel, result.get('error'))}
+
+        for item in result:
+            utterance = dict(item) if isinstance(item, dict) else {'text': item}
+            utterance.pop('audio_part_start_time', None)
+            utterance['channel'] = channel
+            utterance['start_time'] = utterance_start_time(item)
+            utterances.append(utterance)
+
+    return sorted(utterances, key=lambda utterance: (utterance['start_time'], utterance['channel']))
@@ -1,26 +1,76 @@
 import os
 import json
-import sys
 
-from google.cloud import speech_v1p1beta1 as _speech_beta
-from google.cloud.speech_v1p1beta1 import enums as _enums_beta
-from google.cloud.speech_v1p1beta1 import types as _types_beta
 
-from google.cloud import speech as _speech
-from google.cloud.speech import enums as _enums
-from google.cloud.speech import types as _types
+class CredentialsError(Exception):
+    """Required environment variable of provider isn't set or credentials file can't be read.
+        """
 
 
 class GlobalConfig(object):
     language_code = "en-US"
     required_env_variables = {}
+    variables_loaded = False
+    # Count of simultaneous recognitions of provider in async mode
+    max_concurrent_recognitions = 100
+    # Recognize every channel separately and merge them into dialog (any provider)
+    demux_channels = False
+    # How several comma separated methods are used (fallback, race or hedge)
+    multi_method_mode = 'fallback'
+    # Seconds to wait for method in hedge mode before the next method is started
+    hedge_delay = 30
+    # Requests to provider per second (0 - unlimited), count of requests sent at once after idle time and
+    # count of simultaneous requests (0 - unlimited)
+    requests_per_second = 0
+    requests_burst = 1
+    max_concurrent_calls = 0
+    # Requests rejected by quota are repeated, delay is doubled after every rejection in a row
+    quota_retries = 5
+    quota_backoff = 1.0
+    quota_backoff_max = 60
+    # Voice activity detection of audio, which is split before recognition: level threshold in dB,
+    # level measure (peak or rms), analysis block, pauses kept inside segments, padding around segments,
+    # pauses between segments, which are merged, and min and max (0 - unlimited) segment duration in seconds
+    vad_threshold = -30
+    vad_measure = 'peak'
+    vad_block_duration = 0.01
+    vad_min_silence = 0.5
+    vad_padding = 0.25
+    vad_merge_gap = 0
+    vad_min_speech = 0
+    vad_max_segment = 0
+    # Adjacent speech segments are packed into one request up to target duration, segments longer than max
+    # duration of provider request are cut at the quietest point (0 - no packing, no limit)
+    segment_target_duration = 0
+    segment_max_duration = 0
+    # Max size of request with 16 bit PCM, segments are cut to fit it at sample rate of audio (0 - unlimited)
+    segment_max_bytes = 0
+    vad_settings = ('vad_threshold', 'vad_measure', 'vad_block_duration', 'vad_min_silence', 'vad_padding',
+                    'vad_merge_gap', 'vad_min_speech', 'vad_max_segment', 'segment_target_duration',
+                    'segment_max_duration', 'segment_max_bytes')
+    # Settings, which change recognition result (used in result cache key)
+    recognition_settings = ('language_code', 'demux_channels')
+
+    @classmethod
+    def get_settings(cls):
+        return {name: getattr(cls, name) for name in cls.recognition_settings}
 
     @classmethod
     def load_variables(cls):
+        """
+        Load required variables once per process, so batch runs don't re-read credentials for every file
+        """
+        if cls.__dict__.get('variables_loaded'):
+            return
+
+        cls.read_variables()
+        cls.variables_loaded = True
+
+    @classmethod
+    def read_variables(cls):
         for key,value in cls.required_env_variables.items():
             if key not in os.environ:
-                print(json.dumps({'error': "Environment variable \"{!s}\" is not set".format(key)}))
-                sys.exit(0)
+                raise CredentialsError("Environment variable \"{!s}\" is not set".format(key))
             else:
                 setattr(cls, value, os.environ[key])
 
@@ -28,6 +78,13 @@ class GlobalConfig(object):
 class WitASR(GlobalConfig):
     API_ENDPOINT = 'https://api.wit.ai/speech'
 
+    max_duration = 13
+    segment_target_duration = max_duration
+    segment_max_duration = max_duration
+    sample_rate_hertz = 16000
+    max_concurrent_requests = 8
+    recognition_settings = GlobalConfig.recognition_settings + GlobalConfig.vad_settings
+
     access_token = None
 
     required_env_variables = {
@@ -35,8 +92,67 @@ class WitASR(GlobalConfig):
     }
 
 
+class CacheConfig(GlobalConfig):
+    enabled = False
+    file_name = os.path.abspath(os.path.dirname(__file__) + "/../cache/results.sqlite")
+    max_entries = 100000
+    max_size_bytes = 512 * 1024 * 1024
+    ttl_seconds = 30 * 24 * 3600
+
+
+class LimitsConfig(GlobalConfig):
+    # Share provider limits by all processes, which use the same file
+    shared = False
+    file_name = os.path.abspath(os.path.dirname(__file__) + "/../cache/limits.sqlite")
+
+
+class MetricsConfig(GlobalConfig):
+    # Add spans of pipeline stages to the output of every file
+    timings = False
+    # File for Prometheus text export of process metrics, None - don't write
+    metrics_file = None
+
+
+class LiveConfig(GlobalConfig):
+    # Live audio is mono signed 16 bit little-endian PCM (RTP payload is decoded from G.711 or L16)
+    sample_rate_hertz = 8000
+    # Dynamic RTP payload type of mono L16 audio at sample rate of live audio (None - only G.711 and static L16)
+    rtp_payload_type = None
+    chunk_duration = 0.1
+    # Count of chunks, which are buffered between source and recognition
+    queue_size = 50
+    # Stop, if growing file or socket gets no data for this time
+    idle_timeout = 10
+    # Providers limit duration of one stream, so live audio is sent by consecutive sessions
+    session_duration = 290
+
+
+class HttpConfig(GlobalConfig):
+    pool_connections = 10
+    pool_maxsize = 16
+    max_retries = 3
+    backoff_factor = 0.5
+    timeout = 60
+
+
+class ServerConfig(GlobalConfig):
+    host = '127.0.0.1'
+    port = 8765
+    workers = 4
+
+
 class YandexASR(GlobalConfig):
     split_by_silence = True
+    max_concurrent_streams = 8
+    single_pass_split = True
+    sample_rate_hertz = 8000
+    # Streams are limited to 5 minutes and 10 MB of audio. Packing is off by default: Yandex returns no word times,
+    # so text of packed segments can't be split back into utterances
+    segment_target_duration = 0
+    segment_max_duration = 290
+    segment_max_bytes = 10 * 1024 * 1024
+    recognition_settings = GlobalConfig.recognition_settings + GlobalConfig.vad_settings + (
+        'split_by_silence', 'sample_rate_hertz')
     service_account_id = None
     key_id = None
     private_cert = None
@@ -59,7 +175,17 @@ class GoogleASR(GlobalConfig):
     enable_speaker_diarization = False
     diarization_speaker_count = False
     phrases_list = []
+    streaming = False
+    streaming_max_duration = 300
+    streaming_chunk_size = 16000
+    operation_timeout = 1000
+    # Transcode input to compact format before recognition (None, flac or ogg_opus)
+    transcode = None
+    poll_interval = 1.0
     api_data = {}
+    recognition_settings = GlobalConfig.recognition_settings + (
+        'confidence', 'use_beta', 'split_by_channels', 'automatic_punctuation', 'enable_speaker_diarization',
+        'diarization_speaker_count', 'phrases_list', 'streaming', 'transcode')
     required_env_variables = {
         'GOOGLE_APPLICATION_CREDENTIALS': 'api_file',
         'GOOGLE_APPLICATION_PROJECT_NAME': 'project_name'
@@ -77,9 +203,18 @@ class GoogleASR(GlobalConfig):
 
     @staticmethod
     def get_libs():
+        # Google libraries are imported only when Google recognition is used
         if GoogleASR.use_beta:
+            from google.cloud import speech_v1p1beta1 as _speech_beta
+            from google.cloud.speech_v1p1beta1 import enums as _enums_beta
+            from google.cloud.speech_v1p1beta1 import types as _types_beta
+
             google_libs = GoogleASR.GoogleLibs(_speech_beta, _types_beta, _enums_beta)
         else:
+            from google.cloud import speech as _speech
+            from google.cloud.speech import enums as _enums
+            from google.cloud.speech import types as _types
+
             google_libs = GoogleASR.GoogleLibs(_speech, _types, _enums)
 
         return google_libs
@@ -90,10 +225,9 @@ class GoogleASR(GlobalConfig):
             with open(os.path.abspath(GoogleASR.api_file)) as f:
                 GoogleASR.api_data = json.load(f)
         except IOError as err:
-            print(json.dumps({'error': "Caught error \"{0!s}\" in file {1!s}".format(err.strerror, err.filename)}))
-            sys.exit(0)
+            raise CredentialsError("Caught error \"{0!s}\" in file {1!s}".format(err.strerror, err.filename))
 
     @classmethod
-    def load_variables(cls):
-        super(GoogleASR, cls).load_variables()
+    def read_variables(cls):
+        super(GoogleASR, cls).read_variables()
         GoogleASR.__load_api_data()
@@ -0,0 +1,237 @@
+import os
+import queue
+import errno
+from concurrent.futures import ThreadPoolExecutor
+
+from . import metrics
+from .probe import AudioProbe
+from .limits import get_limiter, is_quota_error
+from .credentials import GlobalConfig, GoogleASR, YandexASR
+from .recognizers import recognize, recognition_methods, recognition_configs, get_result_cache, \
+    get_yandex_iam, split_by_ffmpeg, google_recognition_setup, google_streaming_results, google_result_to_object
+from .cache import ResultCache
+
+
+def result_events(result):
+    """
+    Convert result of recognize into events
+    :return: list of "utterance" events or one "error" event
+    :rtype: list
+    """
+    if isinstance(result, dict):
+        return [{'event': 'error', 'error': result.get('error')}]
+
+    events = []
+    for item in result or []:
+        event = {'event': 'utterance'}
+        if isinstance(item, dict):
+            event.update(item)
+        else:
+            event['text'] = item
+        events.append(event)
+
+    return events
+
+
+def retry_until_emitted(consume, emit):
+    """
+    Wrap function, which emits events, for ProviderLimiter.call. Call rejected by quota is repeated only while
+    nothing was emitted, later quota errors are raised as IOError, so events aren't emitted twice
+    :param consume: function, which accepts emit function and other arguments
+    :param emit: function, which is called with every event
+    :return: function, which accepts other arguments of consume
+    """
+    emitted = []
+
+    def emit_tracked(event):
+        emitted.append(True)
+        emit(event)
+
+    def call(*args, **kwargs):
+        try:
+            return consume(emit_tracked, *args, **kwargs)
+        except Exception as err:
+            if emitted and is_quota_error(err):
+                raise IOError("Quota error after results were received: {0!s}".format(err))
+            raise
+
+    return call
+
+
+def stream_events(workers: list, max_workers: int):
+    """
+    Run workers in thread pool and yield their events as soon as they are emitted
+    :param workers: functions, which accept emit function and call it with every event
+    :param max_workers: count of simultaneous workers
+    :return: generator of events
+    """
+    events = queue.Queue()
+
+    def run(worker):
+        try:
+            worker(events.put)
+        except Exception as err:
+            events.put({'event': 'error', 'error': "Caught error \"{0!s}\" in recognition".format(err)})
+        finally:
+            events.put(None)
+
+    executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+    for worker in workers:
+        executor.submit(metrics.bind(run), worker)
+    # Submitted workers are finished in background, if consumer stops reading events
+    executor.shutdown(wait=False)
+
+    finished = 0
+    while finished < len(workers):
+        event = events.get()
+        if event is None:
+            finished += 1
+        else:
+            yield event
+
+
+def yandex_workers(file_name: str, partials: bool):
+    """
+    Get workers, which stream parts of file to Yandex and emit every final (and partial) text of part
+    :rtype: list
+    """
+    from .ysk.stt_lib import YandexSTT
+
+    iam_key = get_yandex_iam()
+
+    if YandexASR.split_by_silence:
+        audio_parts = split_by_ffmpeg(file_name)
+        delete = True
+    else:
+        audio_parts = [{
+            "index": 1,
+            "file_name": file_name,
+            "start": 0
+        }]
+        delete = False
+
+    limiter = get_limiter('yandex', YandexASR)
+
+    def part_worker(audio_file):
+        if 'audio' in audio_file:
+            source = (audio_file['audio'], 'LINEAR16_PCM', YandexASR.sample_rate_hertz)
+        else:
+            source = (audio_file['file_name'], None, None)
+
+        def consume(emit):
+            for text, final in YandexSTT.stream(YandexASR.folder_id, iam_key, source[0], YandexASR.language_code,
+                                                audio_encoding=source[1], sample_rate_hertz=source[2]):
+                if final or partials:
+                    emit({'event': 'utterance' if final else 'partial', 'text': text,
+                          'audio_part_start_time': audio_file['start']})
+
+        def worker(emit):
+            try:
+                with metrics.provider('yandex'), metrics.span('streaming', part=audio_file['index']):
+                    limiter.call(retry_until_emitted(consume, emit))
+                    if 'audio' in audio_file:
+                        metrics.count('sent_bytes', len(audio_file['audio']))
+            finally:
+                if delete and 'file_name' in audio_file:
+                    os.remove(audio_file['file_name'])
+
+        return worker
+
+    return [part_worker(audio_file) for audio_file in audio_parts]
+
+
+def google_workers(file_name: str, partials: bool):
+    """
+    Get worker, which streams file to Google and emits every final (and interim) result
+    :rtype: list
+    """
+
+    def worker(emit):
+        with metrics.provider('google'):
+            setup = google_recognition_setup(file_name)
+            if 'error' in setup:
+                emit({'event': 'error', 'error': setup['error']})
+                return
+
+            def consume(emit):
+                for result in google_streaming_results(setup['client'], setup['types'], setup['config'],
+                                                       setup['file_name'], partials):
+                    if result.is_final:
+                        event = {'event': 'utterance'}
+                        event.update(google_result_to_object(result))
+                    else:
+                        event = {'event': 'partial', 'text': result.alternatives[0].transcript}
+                    emit(event)
+
+            try:
+                with metrics.span('streaming', bytes=os.path.getsize(setup['file_name'])):
+                    get_limiter('google', GoogleASR).call(retry_until_emitted(consume, emit))
+            finally:
+                if setup['temp_file']:
+                    os.remove(setup['temp_file'])
+
+    return [worker]
+
+
+def streaming_workers(file_name: str, method_name: str, partials: bool):
+    """
+    :return: workers of provider, which returns results while audio is being sent, or None
+    """
+    if method_name == 'yandex':
+        return yandex_workers(file_name, partials), YandexASR.max_concurrent_streams
+
+    if method_name == 'google' and GoogleASR.streaming and \
+            AudioProbe.get_info(file_name).duration_seconds <= GoogleASR.streaming_max_duration:
+        return google_workers(file_name, partials), 1
+
+    return None
+
+
+def recognize_stream(file_name, method_name, partials=False):
+    """
+    Recognize file and yield events as soon as results are received:
+    {"event": "partial", "text": ...} - not final text, only if partials is set,
+    {"event": "utterance", ...} - final utterance in the same format as items of recognize result,
+    {"event": "error", "error": ...} and {"event": "end"}, which is always the last event.
+    Yandex and Google streaming recognition emit every utterance of a part as soon as it is recognized (parts
+    are recognized concurrently, so utterances of different parts may be mixed). Other providers, several
+    methods and demux mode emit utterances when the whole file is recognized
+    :param file_name: path to media file
+    :param method_name: recognition method or comma separated methods
+    :param partials: emit not final results
+    :return: generator of events
+    """
+    file_object = os.path.abspath(file_name)
+    if not os.path.isfile(file_object):
+        yield {'event': 'error', 'error': "Caught error \"" + os.strerror(errno.ENOENT) + "\" in file " + file_object}
+        yield {'event': 'end'}
+        return
+
+    workers = None
+    if method_name in recognition_methods and not GlobalConfig.demux_channels:
+        cache = get_result_cache()
+        cached_result = cache.get(ResultCache.make_key(file_object, method_name,
+                                                       recognition_configs[method_name].get_settings())) \
+            if cache else None
+
+        if cached_result:
+            for event in result_events(cached_result):
+                yield event
+            yield {'event': 'end'}
+            return
+
+        try:
+            workers = streaming_workers(file_object, method_name, partials)
+        except (Exception, SystemExit) as err:
+            yield {'event': 'error', 'error': "Caught error \"{0!s}\" in {1!s} recognition".format(err, method_name)}
+            yield {'event': 'end'}
+            return
+
+    if workers:
+        for event in stream_events(*workers):
+            yield event
+    else:
+        for event in result_events(recognize(file_object, method_name)):
+            yield event
+
+    yield {'event': 'end'}
@@ -1,7 +1,10 @@
 from google.cloud import storage
 from google.cloud.storage.blob import Blob
 from google.cloud.exceptions import NotFound
+from concurrent.futures import ThreadPoolExecutor
+from .cache import ResultCache
 import os
+import threading
 
 
 class GoogleStorageUploader(object):
@@ -32,11 +35,29 @@ class GoogleStorageUploader(object):
 
         :type delete_old: bool
         :param delete_old: Delete old bucket at first and recreate new one
+
+        :type composite_threshold: int
+        :param composite_threshold: Files of this size in bytes and larger are uploaded
+                                    by parallel parts, which are composed into one blob
+
+        :type composite_parts: int
+        :param composite_parts: Count of parts for composite upload (32 at most)
+
+        :type max_workers: int
+        :param max_workers: Count of simultaneous uploads of parts
         """
+    BLOB_PREFIX = 'audio/'
 
-    def __init__(self, bucket: str, project=None, credentials=None, _http=None, delete_old=False):
+    def __init__(self, bucket: str, project=None, credentials=None, _http=None, delete_old=False,
+                 composite_threshold=64 * 1024 * 1024, composite_parts=8, max_workers=8):
         self.client = storage.Client(project, credentials, _http)
         self.bucket = bucket
+        self.composite_threshold = composite_threshold
+        self.composite_parts = max(1, min(32, composite_parts))
+        self.parts_executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.__lock = threading.Lock()
+        self.__upload_locks = {}
+        self.__references = {}
         self.__check_bucket(delete_old)
 
     def __check_bucket(self, delete_old=False):
@@ -57,24 +78,82 @@ class GoogleStorageUploader(object):
     def __delete_old(self):
         self.bucket_object.delete()
 
+    @staticmethod
+    def blob_name(file_path: str):
+        """
+        Get content-addressed blob name, so the same audio is uploaded only once
+        and different files with the same name don't collide
+        :rtype: str
+        """
+        extension = os.path.splitext(file_path)[1].lower()
+        return GoogleStorageUploader.BLOB_PREFIX + ResultCache.file_hash(file_path) + extension
+
     def upload_file(self, file_path: str):
         """
         :param file_path: path to the file
         :rtype: :class:`google.cloud.storage.blob.Blob`
         :returns: The blob object created.
         """
-        basename = os.path.basename(file_path)
         full_path = os.path.abspath(file_path)
+        name = self.blob_name(full_path)
 
-        # with open(full_path) as file_object:
-        blob = self.bucket_object.blob(basename)
-        if not blob.exists():
-            blob.upload_from_filename(full_path)
+        with self.__lock:
+            self.__references[name] = self.__references.get(name, 0) + 1
+            upload_lock = self.__upload_locks.setdefault(name, threading.Lock())
+
+        try:
+            # Concurrent uploads of the same content wait for the first one
+            with upload_lock:
+                blob = self.bucket_object.blob(name)
+                if not blob.exists():
+                    size = os.path.getsize(full_path)
+                    if size >= self.composite_threshold and self.composite_parts > 1:
+                        self.__upload_composite(blob, full_path, size)
+                    else:
+                        blob.upload_from_filename(full_path)
+        except Exception:
+            self.__release(name)
+            raise
 
         return blob
 
-    def delete_file(self, blob: Blob):
+    def __upload_composite(self, blob: Blob, full_path: str, size: int):
+        part_size = -(-size // self.composite_parts)
+        part_blobs = [self.bucket_object.blob(blob.name + ".part" + str(index))
+                      for index in range(self.composite_parts) if index * part_size < size]
+
+        def upload_part(index):
+            with open(full_path, 'rb') as file_object:
+                file_object.seek(index * part_size)
+                part_blobs[index].upload_from_file(file_object, size=min(part_size, size - index * part_size))
+
+        try:
+            list(self.parts_executor.map(upload_part, range(len(part_blobs))))
+            blob.compose(part_blobs)
+        finally:
+            for part_blob in part_blobs:
+                self.delete_blob(part_blob)
+
+    def release_file(self, blob: Blob):
+        """
+        Release uploaded blob. Content-addressed blobs aren't deleted, because other processes may recognize
+        the same content at the same time, they are removed by lifecycle rule of the bucket after 1 day
+        """
+        self.__release(blob.name)
+
+    def __release(self, name: str):
+        with self.__lock:
+            references = self.__references.get(name, 1) - 1
+            if references > 0:
+                self.__references[name] = references
+            else:
+                self.__references.pop(name, None)
+                self.__upload_locks.pop(name, None)
+
+    @staticmethod
+    def delete_blob(blob: Blob):
         try:
             blob.delete()
+            return True
         except NotFound:
             return False
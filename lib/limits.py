@@ -0,0 +1,296 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from . import metrics
+from .credentials import GlobalConfig, LimitsConfig
+
+
+class QuotaError(Exception):
+    """Request was rejected by provider quota (HTTP 429 or gRPC RESOURCE_EXHAUSTED).
+
+        :type retry_after: float
+        :param retry_after: seconds to wait, if provider told it
+        """
+
+    def __init__(self, message: str, retry_after=None):
+        super(QuotaError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def is_quota_error(err: Exception):
+    """
+    Check if exception of Google, gRPC or HTTP client means exceeded quota
+    :rtype: bool
+    """
+    if isinstance(err, QuotaError):
+        return True
+
+    code = getattr(err, 'code', None)
+    if callable(code):
+        # grpc.RpcError
+        try:
+            code = code()
+        except Exception:
+            return False
+
+    return code == 429 or getattr(code, 'name', None) == 'RESOURCE_EXHAUSTED'
+
+
+class LimiterState(object):
+    """Token bucket state of provider in GCRA form: theoretical arrival time of the next request, time until
+    requests are blocked after quota error, count of quota errors in a row and current fraction of configured rate.
+    State is kept in memory or in SQLite database, which is shared by processes.
+
+        :type file_name: str
+        :param file_name: path to SQLite database, None to keep state in memory of process
+        """
+
+    def __init__(self, file_name=None):
+        self.file_name = os.path.abspath(file_name) if file_name else None
+        self._states = {}
+        self._lock = threading.Lock()
+
+        if self.file_name:
+            dir_name = os.path.dirname(self.file_name)
+            if not os.path.isdir(dir_name):
+                os.makedirs(dir_name, exist_ok=True)
+
+            with self.__connect() as connection:
+                connection.execute('CREATE TABLE IF NOT EXISTS limits ('
+                                   'name TEXT PRIMARY KEY, tat REAL NOT NULL, blocked_until REAL NOT NULL, '
+                                   'failures INTEGER NOT NULL, factor REAL NOT NULL)')
+
+    @contextmanager
+    def __connect(self):
+        connection = sqlite3.connect(self.file_name, timeout=30, isolation_level=None)
+        try:
+            yield connection
+        finally:
+            connection.close()
+
+    @contextmanager
+    def transaction(self, name: str):
+        """
+        Read state of provider, let caller change it and store it back atomically
+        :return: context manager, which yields mutable dict with tat, blocked_until, failures and factor keys
+        """
+        if not self.file_name:
+            with self._lock:
+                state = self._states.setdefault(name, {'tat': 0.0, 'blocked_until': 0.0, 'failures': 0,
+                                                       'factor': 1.0})
+                yield state
+            return
+
+        with self.__connect() as connection:
+            # Write lock is taken before read, so concurrent processes don't reserve the same slot
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tat, blocked_until, failures, factor FROM limits WHERE name = ?',
+                                         (name,)).fetchone()
+                state = dict(zip(('tat', 'blocked_until', 'failures', 'factor'), row or (0.0, 0.0, 0, 1.0)))
+                yield state
+                connection.execute('INSERT OR REPLACE INTO limits (name, tat, blocked_until, failures, factor) '
+                                   'VALUES (?, ?, ?, ?, ?)', (name, state['tat'], state['blocked_until'],
+                                                              state['failures'], state['factor']))
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+
+class ProviderLimiter(object):
+    """Rate and concurrency limiter of one provider. Requests are spaced by token bucket, count of simultaneous
+    requests is limited by semaphore (and by lock files, if state is shared by processes). Quota errors block
+    all requests of provider with exponential backoff and halve the rate, successful requests restore it.
+
+        :type name: str
+        :param name: provider name
+
+        :type config: GlobalConfig
+        :param config: provider config with requests_per_second, requests_burst, max_concurrent_calls,
+            quota_retries, quota_backoff and quota_backoff_max
+        """
+    MIN_FACTOR = 0.1
+    FACTOR_STEP = 0.05
+    LOCK_POLL_INTERVAL = 0.05
+
+    def __init__(self, name: str, config=GlobalConfig, state=None, lock_dir=None):
+        self.name = name
+        self.config = config
+        self.state = state or LimiterState()
+        self.lock_dir = lock_dir if fcntl else None
+
+        concurrency = config.max_concurrent_calls
+        self.semaphore = threading.BoundedSemaphore(concurrency) if concurrency > 0 else None
+
+    def reserve(self):
+        """
+        Take a token from bucket
+        :return: seconds to wait before request may be sent
+        :rtype: float
+        """
+        now = time.time()
+        with self.state.transaction(self.name) as state:
+            rate = self.config.requests_per_second * state['factor']
+            interval = 1.0 / rate if rate > 0 else 0.0
+
+            tat = max(state['tat'], now, state['blocked_until'])
+            allowed = max(now, state['blocked_until'], tat - (max(1, self.config.requests_burst) - 1) * interval)
+            state['tat'] = tat + interval
+
+        return allowed - now
+
+    def penalize(self, err: Exception):
+        """
+        Block requests of provider after quota error
+        :return: seconds until requests are allowed again
+        :rtype: float
+        """
+        now = time.time()
+        with self.state.transaction(self.name) as state:
+            state['failures'] += 1
+            state['factor'] = max(self.MIN_FACTOR, state['factor'] / 2)
+
+            delay = getattr(err, 'retry_after', None) or \
+                self.config.quota_backoff * 2 ** (state['failures'] - 1)
+            state['blocked_until'] = max(state['blocked_until'], now + min(delay, self.config.quota_backoff_max))
+
+            return state['blocked_until'] - now
+
+    def succeed(self):
+        with self.state.transaction(self.name) as state:
+            state['failures'] = 0
+            state['factor'] = min(1.0, state['factor'] + self.FACTOR_STEP)
+
+    def acquire(self):
+        """
+        Wait for free slot and token
+        :return: lock file of slot or None
+        """
+        with metrics.span('limit_wait'):
+            if self.semaphore:
+                self.semaphore.acquire()
+
+            try:
+                lock_file = self.__lock_slot()
+            except BaseException:
+                if self.semaphore:
+                    self.semaphore.release()
+                raise
+
+            delay = self.reserve()
+            if delay > 0:
+                time.sleep(delay)
+
+        return lock_file
+
+    def release(self, lock_file=None):
+        if lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+
+        if self.semaphore:
+            self.semaphore.release()
+
+    def __lock_slot(self):
+        # Semaphore of processes: every slot is lock file, locks are released by OS if process dies
+        if not self.lock_dir or self.config.max_concurrent_calls <= 0:
+            return None
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        while True:
+            for slot in range(self.config.max_concurrent_calls):
+                lock_file = open(os.path.join(self.lock_dir, '{0!s}.{1!s}.lock'.format(self.name, slot)), 'a')
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return lock_file
+                except OSError:
+                    lock_file.close()
+
+            time.sleep(self.LOCK_POLL_INTERVAL)
+
+    @contextmanager
+    def slot(self):
+        lock_file = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(lock_file)
+
+    def call(self, func, *args, **kwargs):
+        """
+        Call provider inside limits. Calls rejected by quota are repeated after backoff up to quota_retries times
+        :return: result of func
+        """
+        attempt = 0
+        while True:
+            try:
+                with self.slot():
+                    result = func(*args, **kwargs)
+            except Exception as err:
+                if not is_quota_error(err) or attempt >= self.config.quota_retries:
+                    raise
+                attempt += 1
+                metrics.count('quota_errors')
+                self.penalize(err)
+                continue
+
+            self.succeed()
+            return result
+
+    async def call_async(self, func, *args, **kwargs):
+        """
+        The same as call for coroutine function. Waiting for slot and token is done in executor
+        """
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        while True:
+            lock_file = await loop.run_in_executor(None, metrics.bind(self.acquire))
+            try:
+                result = await func(*args, **kwargs)
+            except Exception as err:
+                if not is_quota_error(err) or attempt >= self.config.quota_retries:
+                    raise
+                attempt += 1
+                metrics.count('quota_errors')
+                self.penalize(err)
+                continue
+            finally:
+                self.release(lock_file)
+
+            self.succeed()
+            return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+_state = None
+
+
+def get_limiter(name: str, config=GlobalConfig):
+    """
+    Get limiter of provider, which is shared by threads of process (and by processes, if LimitsConfig.shared is set)
+    :param name: provider name (google, yandex, wit)
+    :param config: provider config
+    :rtype: ProviderLimiter
+    """
+    global _state
+
+    with _limiters_lock:
+        if name not in _limiters:
+            if _state is None:
+                _state = LimiterState(LimitsConfig.file_name if LimitsConfig.shared else None)
+
+            lock_dir = os.path.splitext(LimitsConfig.file_name)[0] + '.locks' if LimitsConfig.shared else None
+            _limiters[name] = ProviderLimiter(name, config, _state, lock_dir)
+
+        return _limiters[name]
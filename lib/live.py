@@ -0,0 +1,451 @@
+import os
+import sys
+import stat
+import time
+import queue
+import socket
+import threading
+from array import array
+from urllib.parse import urlsplit
+
+from . import metrics
+from .audio import SAMPLE_WIDTH
+from .limits import get_limiter
+from .events import stream_events, retry_until_emitted
+from .credentials import LiveConfig, GoogleASR, YandexASR
+from .recognizers import get_yandex_iam, get_google_client, google_recognition_config, google_streaming_results, \
+    google_result_to_object
+
+WAV_HEADER_SIZE = 44
+RTP_HEADER_SIZE = 12
+# Static RTP payload types: G.711 mu-law, G.711 A-law and L16 mono (big-endian, 44100 Hz)
+RTP_PCMU = 0
+RTP_PCMA = 8
+RTP_L16_MONO = 11
+QUEUE_POLL_INTERVAL = 0.1
+
+
+def live_chunk_size(sample_rate: int):
+    """
+    :return: size of LiveConfig.chunk_duration piece of PCM in bytes
+    :rtype: int
+    """
+    return max(1, int(sample_rate * LiveConfig.chunk_duration)) * SAMPLE_WIDTH
+
+
+def read_pipe(fd: int, chunk_size: int):
+    """
+    Read stdin or named pipe until writer closes it. Data is returned as soon as it is written, without waiting
+    for the whole chunk
+    :param fd: file descriptor
+    :return: generator of bytes
+    """
+    data = os.read(fd, chunk_size)
+    while data:
+        yield data
+        data = os.read(fd, chunk_size)
+
+
+def read_fifo(file_name: str, chunk_size: int):
+    """
+    Read named pipe until writer closes it
+    :return: generator of bytes
+    """
+    fd = os.open(file_name, os.O_RDONLY)
+    try:
+        for data in read_pipe(fd, chunk_size):
+            yield data
+    finally:
+        os.close(fd)
+
+
+def read_growing_file(file_name: str, chunk_size: int, idle_timeout: float):
+    """
+    Read file, which is being written by another process, until it doesn't grow for idle_timeout seconds.
+    Header of WAV file is skipped
+    :return: generator of bytes
+    """
+    header = b''
+    header_checked = False
+    idle_since = time.monotonic()
+
+    with open(file_name, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                if time.monotonic() - idle_since >= idle_timeout:
+                    break
+                time.sleep(LiveConfig.chunk_duration)
+                continue
+
+            idle_since = time.monotonic()
+            if not header_checked:
+                header += data
+                if len(header) < WAV_HEADER_SIZE:
+                    continue
+                header_checked = True
+                data = header[WAV_HEADER_SIZE:] if header.startswith(b'RIFF') else header
+
+            if data:
+                yield data
+
+    if not header_checked and header:
+        yield header
+
+
+def rtp_payload(packet: bytes, l16_payload_type=None):
+    """
+    Get audio of RTP packet as signed 16 bit little-endian PCM. G.711 and mono L16 payloads are converted,
+    packets of other payload types (telephone events, comfort noise, stereo L16, video) are dropped
+    :param l16_payload_type: dynamic payload type of mono L16 audio or None
+    :return: bytes or None, if packet isn't RTP or has no supported audio
+    """
+    if len(packet) < RTP_HEADER_SIZE or packet[0] >> 6 != 2:
+        return None
+
+    offset = RTP_HEADER_SIZE + 4 * (packet[0] & 0x0F)
+    if packet[0] & 0x10:
+        # Header extension: profile, length in 32 bit words, data
+        if len(packet) < offset + 4:
+            return None
+        offset += 4 + 4 * int.from_bytes(packet[offset + 2:offset + 4], 'big')
+
+    end = len(packet)
+    if packet[0] & 0x20:
+        end -= packet[-1]
+
+    payload = packet[offset:end]
+    payload_type = packet[1] & 0x7F
+    if payload_type in (RTP_L16_MONO, l16_payload_type):
+        # L16 is big-endian
+        samples = array('h', payload[:len(payload) // SAMPLE_WIDTH * SAMPLE_WIDTH])
+        samples.byteswap()
+        return samples.tobytes()
+
+    if payload_type not in (RTP_PCMU, RTP_PCMA):
+        return None
+
+    # audioop is deprecated and removed in Python 3.13, it is imported only for G.711 payloads
+    import audioop
+
+    if payload_type == RTP_PCMU:
+        return audioop.ulaw2lin(payload, SAMPLE_WIDTH)
+    return audioop.alaw2lin(payload, SAMPLE_WIDTH)
+
+
+def rtp_ssrc(packet: bytes):
+    """
+    :return: synchronization source identifier of RTP packet
+    :rtype: int
+    """
+    return int.from_bytes(packet[8:RTP_HEADER_SIZE], 'big')
+
+
+def read_socket(host: str, port: int, rtp: bool, idle_timeout: float):
+    """
+    Receive UDP datagrams with PCM or RTP packets. Waiting for the first datagram isn't limited, then reading is
+    stopped, if nothing is received for idle_timeout seconds. Only RTP stream (SSRC) of the first packet with audio
+    is recognized, packets of other streams are dropped
+    :return: generator of bytes
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_DGRAM)
+    ssrc = None
+    try:
+        sock.bind((host, port))
+
+        while True:
+            try:
+                packet = sock.recv(65535)
+            except socket.timeout:
+                break
+            sock.settimeout(idle_timeout)
+
+            if not rtp:
+                data = packet
+            else:
+                data = rtp_payload(packet, LiveConfig.rtp_payload_type)
+                if data is None or ssrc not in (None, rtp_ssrc(packet)):
+                    continue
+                ssrc = rtp_ssrc(packet)
+
+            if data:
+                yield data
+    finally:
+        sock.close()
+
+
+def open_live_source(source: str, chunk_size: int):
+    """
+    Open live audio source: "-" - stdin, "udp://host:port" - raw PCM datagrams, "rtp://host:port" - RTP packets,
+    path to named pipe or to file, which is being written
+    :return: generator of bytes and flag, if the source can't be slowed down (audio is dropped, if queue is full)
+    :rtype: tuple
+    """
+    if source == '-':
+        return read_pipe(sys.stdin.buffer.fileno(), chunk_size), False
+
+    address = urlsplit(source)
+    if address.scheme in ('udp', 'rtp'):
+        if not address.port:
+            raise ValueError("Port of live source " + source + " isn't set")
+        return read_socket(address.hostname or '0.0.0.0', address.port, address.scheme == 'rtp',
+                           LiveConfig.idle_timeout), True
+
+    file_name = os.path.abspath(source)
+    if stat.S_ISFIFO(os.stat(file_name).st_mode):
+        return read_fifo(file_name, chunk_size), False
+
+    return read_growing_file(file_name, chunk_size, LiveConfig.idle_timeout), False
+
+
+class LiveAudio(object):
+    """Bounded buffer between live source and recognition. Source is read in background thread. If buffer is full,
+    reading of pipes and files waits for recognition, so writer is slowed down, and the oldest audio of sockets
+    is dropped. Audio is taken from buffer by sessions of limited size.
+
+        :type chunks: iterable
+        :param chunks: audio source, iterable of bytes
+
+        :type max_chunks: int
+        :param max_chunks: size of buffer in chunks
+
+        :type drop: bool
+        :param drop: drop the oldest chunk instead of waiting, if buffer is full
+        """
+
+    def __init__(self, chunks, max_chunks: int, drop=False):
+        self.queue = queue.Queue(maxsize=max(1, max_chunks))
+        self.drop = drop
+        self.error = None
+        self.finished = False
+        self.offset = 0
+        self._pending = b''
+        self._closed = threading.Event()
+
+        self._thread = threading.Thread(target=metrics.bind(self.__read), args=(chunks,), daemon=True)
+        self._thread.start()
+
+    def __read(self, chunks):
+        try:
+            for data in chunks:
+                if self._closed.is_set():
+                    break
+                metrics.count('live_bytes', len(data))
+                if self.drop:
+                    self.__put_latest(data)
+                else:
+                    self.__put(data)
+        except Exception as err:
+            self.error = err
+        finally:
+            self.__put(None)
+
+    def __put(self, item):
+        while not self._closed.is_set():
+            try:
+                self.queue.put(item, timeout=QUEUE_POLL_INTERVAL)
+                return
+            except queue.Full:
+                continue
+
+    def __put_latest(self, data):
+        while True:
+            try:
+                self.queue.put_nowait(data)
+                return
+            except queue.Full:
+                try:
+                    metrics.count('dropped_bytes', len(self.queue.get_nowait() or b''))
+                except queue.Empty:
+                    pass
+
+    def __get(self):
+        if self._pending:
+            data, self._pending = self._pending, b''
+            return data
+
+        while not self.finished:
+            try:
+                data = self.queue.get(timeout=QUEUE_POLL_INTERVAL)
+            except queue.Empty:
+                if self._closed.is_set():
+                    self.finished = True
+                continue
+
+            if data is None:
+                self.finished = True
+            return data
+
+        return None
+
+    def has_audio(self):
+        """
+        Wait for the next chunk
+        :return: False, if source is finished and buffer is empty
+        :rtype: bool
+        """
+        self._pending = self.__get() or b''
+        return bool(self._pending)
+
+    def session(self, max_bytes: int):
+        """
+        Take up to max_bytes of audio. Session ends at byte offset, which is a multiple of max_bytes,
+        so sessions are cut between samples
+        :return: generator of bytes
+        """
+        end = (self.offset // max_bytes + 1) * max_bytes
+        while self.offset < end:
+            data = self.__get()
+            if not data:
+                return
+
+            if self.offset + len(data) > end:
+                data, self._pending = data[:end - self.offset], data[end - self.offset:]
+
+            self.offset += len(data)
+            yield data
+
+    def close(self):
+        """
+        Stop reading of source
+        """
+        self._closed.set()
+
+
+class ReplayableChunks(object):
+    """Chunks of one live session, which can be iterated again. Every iteration yields chunks, which were already
+    taken from source, and continues with the source, so session rejected by quota is repeated with the same audio.
+
+        :type chunks: iterable
+        :param chunks: chunks of session, which can be read only once
+        """
+
+    def __init__(self, chunks):
+        self.source = iter(chunks)
+        self.taken = []
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._lock:
+                if index < len(self.taken):
+                    data = self.taken[index]
+                else:
+                    data = next(self.source, None)
+                    if data is None:
+                        return
+                    self.taken.append(data)
+
+            index += 1
+            yield data
+
+
+def yandex_live_session(sample_rate: int, partials: bool):
+    """
+    :return: function, which recognizes one session of live audio with Yandex and emits events
+    """
+    from .ysk.stt_lib import YandexSTT
+
+    def consume(emit, chunks):
+        for text, final in YandexSTT.stream(YandexASR.folder_id, get_yandex_iam(), chunks, YandexASR.language_code,
+                                            audio_encoding='LINEAR16_PCM', sample_rate_hertz=sample_rate):
+            if final or partials:
+                emit({'event': 'utterance' if final else 'partial', 'text': text})
+
+    # Credentials are checked before audio is read, token is taken for every session, because it is refreshed
+    get_yandex_iam()
+
+    return consume
+
+
+def google_live_session(sample_rate: int, partials: bool):
+    """
+    :return: function, which recognizes one session of live audio with Google streaming and emits events
+    """
+    GoogleASR.load_variables()
+
+    google_libs = GoogleASR.get_libs()
+    types = google_libs.types
+    client = get_google_client()
+    config = google_recognition_config(google_libs.enums.RecognitionConfig.AudioEncoding.LINEAR16, sample_rate)
+
+    def consume(emit, chunks):
+        for result in google_streaming_results(client, types, config, chunks, partials):
+            if result.is_final:
+                event = {'event': 'utterance'}
+                event.update(google_result_to_object(result))
+            else:
+                event = {'event': 'partial', 'text': result.alternatives[0].transcript}
+            emit(event)
+
+    return consume
+
+
+live_sessions = {
+    'yandex': (yandex_live_session, YandexASR),
+    'google': (google_live_session, GoogleASR)
+}
+
+
+def recognize_live(source: str, method_name: str, partials=False):
+    """
+    Recognize live audio (mono signed 16 bit PCM with LiveConfig.sample_rate_hertz) and yield events in
+    recognize_stream format as soon as results are received. Audio is sent by consecutive streaming sessions
+    of LiveConfig.session_duration, "audio_part_start_time" of event is the start of its session
+    :param source: "-", "udp://host:port", "rtp://host:port", path to named pipe or growing file
+    :param method_name: yandex or google
+    :param partials: emit not final results
+    :return: generator of events
+    """
+    if method_name not in live_sessions:
+        yield {'event': 'error', 'error': "Live recognition supports only " + ", ".join(sorted(live_sessions)) +
+                                          " methods"}
+        yield {'event': 'end'}
+        return
+
+    session_factory, config = live_sessions[method_name]
+    sample_rate = LiveConfig.sample_rate_hertz
+
+    try:
+        with metrics.provider(method_name):
+            consume = session_factory(sample_rate, partials)
+        chunks, drop = open_live_source(source, live_chunk_size(sample_rate))
+        audio = LiveAudio(chunks, LiveConfig.queue_size, drop)
+    except (Exception, SystemExit) as err:
+        yield {'event': 'error', 'error': "Caught error \"{0!s}\" in {1!s} live recognition".format(err, method_name)}
+        yield {'event': 'end'}
+        return
+
+    session_bytes = max(1, int(sample_rate * LiveConfig.session_duration)) * SAMPLE_WIDTH
+    limiter = get_limiter(method_name, config)
+
+    def worker(emit):
+        index = 0
+        with metrics.provider(method_name):
+            while audio.has_audio():
+                index += 1
+                start = str(audio.offset / float(sample_rate * SAMPLE_WIDTH)) if audio.offset else 0
+
+                def emit_session(event, start=start):
+                    event['audio_part_start_time'] = start
+                    emit(event)
+
+                with metrics.span('streaming', session=index) as attributes:
+                    session_start = audio.offset
+                    # Audio of session is kept, so it can be sent again, if session is rejected by quota
+                    limiter.call(retry_until_emitted(consume, emit_session),
+                                 ReplayableChunks(audio.session(session_bytes)))
+                    attributes['bytes'] = audio.offset - session_start
+                metrics.count('sent_bytes', attributes['bytes'])
+
+        if audio.error:
+            raise audio.error
+
+    try:
+        for event in stream_events([worker], 1):
+            yield event
+    finally:
+        audio.close()
+
+    yield {'event': 'end'}
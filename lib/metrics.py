@@ -0,0 +1,216 @@
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Upper bounds of stage duration histogram buckets in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+METRIC_PREFIX = 'recognizer'
+
+
+class Trace(object):
+    """Spans and counters of one recognition job. Spans may be added from several threads.
+        """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    def add_span(self, stage: str, provider, started: float, duration: float, attributes: dict):
+        span = {'stage': stage, 'start': round(started - self.started, 6), 'duration': round(duration, 6)}
+        if provider:
+            span['provider'] = provider
+        span.update(attributes)
+
+        with self._lock:
+            self.spans.append(span)
+
+    def add_count(self, name: str, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """
+        :return: total time, time and count of spans per stage, counters and spans ordered by start time
+        :rtype: dict
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span['start'])
+            counters = dict(self.counters)
+
+        stages = {}
+        for span in spans:
+            stage = stages.setdefault(span['stage'], {'count': 0, 'seconds': 0.0})
+            stage['count'] += 1
+            stage['seconds'] = round(stage['seconds'] + span['duration'], 6)
+
+        return {
+            'total_seconds': round(time.perf_counter() - self.started, 6),
+            'stages': stages,
+            'counters': counters,
+            'spans': spans
+        }
+
+
+class MetricsRegistry(object):
+    """Process-wide counters and stage duration histograms, labeled by stage and provider.
+        """
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                histogram['buckets'][index] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join('{0!s}="{1!s}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in labels) + '}'
+
+    def to_prometheus(self):
+        """
+        Export metrics in Prometheus text exposition format
+        :rtype: str
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, {'buckets': list(value['buckets']), 'sum': value['sum'],
+                                       'count': value['count']}) for key, value in self._histograms.items())
+
+        lines = []
+        described = set()
+
+        for (name, labels), value in counters:
+            metric = METRIC_PREFIX + '_' + name + '_total'
+            if metric not in described:
+                described.add(metric)
+                lines.append('# TYPE ' + metric + ' counter')
+            lines.append(metric + self.format_labels(labels) + ' ' + repr(value))
+
+        for (name, labels), histogram in histograms:
+            metric = METRIC_PREFIX + '_' + name
+            if metric not in described:
+                described.add(metric)
+                lines.append('# TYPE ' + metric + ' histogram')
+
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(metric + '_bucket' + self.format_labels(labels, (('le', repr(float(bound))),)) +
+                             ' ' + str(cumulative))
+            lines.append(metric + '_bucket' + self.format_labels(labels, (('le', '+Inf'),)) + ' ' +
+                         str(histogram['count']))
+            lines.append(metric + '_sum' + self.format_labels(labels) + ' ' + repr(histogram['sum']))
+            lines.append(metric + '_count' + self.format_labels(labels) + ' ' + str(histogram['count']))
+
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# Trace of current job and provider, which is running in current thread or asyncio task
+_context = ContextVar('metrics_context', default=(None, None))
+
+
+@contextmanager
+def trace():
+    """
+    Collect spans of recognition job, which is run inside the block
+    :return: context manager, which yields Trace
+    """
+    job_trace = Trace()
+    token = _context.set((job_trace, _context.get()[1]))
+    try:
+        yield job_trace
+    finally:
+        _context.reset(token)
+
+
+@contextmanager
+def provider(name: str):
+    """
+    Label spans and counters inside the block with provider name
+    """
+    token = _context.set((_context.get()[0], name))
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Measure duration of pipeline stage. Duration is added to stage histogram and to the current trace
+    :param stage: stage name (probe, decode, silence_detection, upload, ...)
+    :param attributes: values, which are added to the span in trace (bytes, segments, ...)
+    :return: context manager, which yields dict of attributes, so they can be added inside the block
+    """
+    started = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        duration = time.perf_counter() - started
+        job_trace, provider_name = _context.get()
+
+        registry.observe('stage_duration_seconds', duration, stage=stage, provider=provider_name or '')
+        if job_trace:
+            job_trace.add_span(stage, provider_name, started, duration, attributes)
+
+
+def count(name: str, value=1):
+    """
+    Increase counter (bytes, segments, requests, ...) of process and of the current trace
+    """
+    job_trace, provider_name = _context.get()
+
+    registry.inc(name, value, provider=provider_name or '')
+    if job_trace:
+        job_trace.add_count(name, value)
+
+
+def bind(func):
+    """
+    Wrap function, so it is run with the current trace and provider in another thread
+    (threads of executors don't inherit context)
+    """
+    context = _context.get()
+
+    def bound(*args, **kwargs):
+        token = _context.set(context)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _context.reset(token)
+
+    return bound
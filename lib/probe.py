@@ -0,0 +1,133 @@
+import os
+import json
+import wave
+import threading
+import subprocess
+from collections import OrderedDict
+
+from . import metrics
+
+
+class AudioInfo(object):
+    """Audio file properties, which are required to configure recognition.
+
+        :type mime: str
+        :param mime: MIME type detected by libmagic
+
+        :type frame_rate: int
+        :param frame_rate: sample rate in Hz
+
+        :type channels: int
+        :param channels: count of audio channels
+
+        :type duration_seconds: float
+        :param duration_seconds: duration of audio stream
+
+        :type codec: str
+        :param codec: codec name in terms of ffprobe (pcm_s16le, opus, flac, ...)
+        """
+
+    def __init__(self, mime: str, frame_rate: int, channels: int, duration_seconds: float, codec: str):
+        self.mime = mime
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.duration_seconds = duration_seconds
+        self.codec = codec
+
+
+class AudioProbe(object):
+    CACHE_SIZE = 1024
+    WAV_CODECS = {1: 'pcm_u8', 2: 'pcm_s16le', 3: 'pcm_s24le', 4: 'pcm_s32le'}
+
+    _cache = OrderedDict()
+    _cache_lock = threading.Lock()
+    _magic = None
+    _magic_lock = threading.Lock()
+
+    @staticmethod
+    def get_info(file_name: str):
+        """
+        Get audio properties by reading headers only. Results are cached by path, size and modification time
+        :param file_name: path to media file
+        :rtype: AudioInfo
+        """
+        file_name = os.path.abspath(file_name)
+        stat = os.stat(file_name)
+        key = (file_name, stat.st_size, stat.st_mtime_ns)
+
+        with AudioProbe._cache_lock:
+            if key in AudioProbe._cache:
+                AudioProbe._cache.move_to_end(key)
+                return AudioProbe._cache[key]
+
+        with metrics.span('mime'):
+            mime = AudioProbe.get_mime(file_name)
+        with metrics.span('probe'):
+            info = AudioProbe.read_wav_header(file_name, mime) or AudioProbe.read_ffprobe(file_name, mime)
+
+        with AudioProbe._cache_lock:
+            AudioProbe._cache[key] = info
+            while len(AudioProbe._cache) > AudioProbe.CACHE_SIZE:
+                AudioProbe._cache.popitem(last=False)
+
+        return info
+
+    @staticmethod
+    def get_mime(file_name: str):
+        """
+        Detect MIME type with one shared libmagic instance (libmagic handles aren't thread-safe)
+        :rtype: str
+        """
+        with AudioProbe._magic_lock:
+            if AudioProbe._magic is None:
+                import magic
+
+                AudioProbe._magic = magic.Magic(mime=True)
+            return AudioProbe._magic.from_file(file_name)
+
+    @staticmethod
+    def read_wav_header(file_name: str, mime: str):
+        """
+        Read properties of PCM WAV file from its header
+        :return: AudioInfo or None, if file isn't PCM WAV
+        """
+        if mime not in ('audio/x-wav', 'audio/wav'):
+            return None
+
+        try:
+            with wave.open(file_name, 'rb') as wav:
+                frame_rate = wav.getframerate()
+                return AudioInfo(mime, frame_rate, wav.getnchannels(), wav.getnframes() / float(frame_rate),
+                                 AudioProbe.WAV_CODECS.get(wav.getsampwidth()))
+        except (wave.Error, EOFError, ZeroDivisionError):
+            return None
+
+    @staticmethod
+    def read_ffprobe(file_name: str, mime: str):
+        """
+        Read properties of the first audio stream with single ffprobe run (file isn't decoded)
+        :rtype: AudioInfo
+        """
+        probe_command = [
+            r'ffprobe',
+            '-v', 'error',
+            '-select_streams', 'a:0',
+            '-show_entries', 'stream=codec_name,sample_rate,channels,duration:format=duration',
+            '-of', 'json',
+            file_name
+        ]
+
+        proc = subprocess.Popen(probe_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+
+        if proc.returncode != 0:
+            raise IOError("ffprobe can't read file " + file_name + ": " + err.decode("utf-8", "replace").strip())
+
+        data = json.loads(out.decode("utf-8"))
+        streams = data.get('streams') or [{}]
+        stream = streams[0]
+        duration = stream.get('duration') or data.get('format', {}).get('duration') or 0
+
+        return AudioInfo(mime, int(stream.get('sample_rate', 0)), int(stream.get('channels', 0)), float(duration),
+                         stream.get('codec_name'))
+
@@ -1,37 +1,121 @@
-import magic
+import os
 import io
+import json
+import errno
+import queue
 import subprocess
+import threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
-from .google_streaming import GoogleStorageUploader
+from . import metrics
+from .probe import AudioProbe
+from .cache import ResultCache
+from .sessions import get_session
+from .limits import get_limiter, QuotaError
+from .transcode import needs_transcoding, transcode_file
+from .audio import decode_pcm, iter_chunks, wav_bytes, write_wav, SAMPLE_WIDTH
+from .vad import detect_speech
+from .channels import demux_channels, merge_channel_results
 from .credentials import *
-from pydub import AudioSegment
-from .ysk.stt_lib import *
+
+# Provider libraries (Google Cloud, gRPC, Yandex protobufs, requests) are imported on first use,
+# so every method pays only for its own dependencies at startup
 
 global_strings = []
 global_yandex_align_time = 0
 global_yandex_already_processed = False
 
+_shared_clients = {}
+_shared_clients_lock = threading.Lock()
+
+
+def get_shared_client(name: str, factory):
+    """
+    Get API client, which is created once per process and reused by every recognition
+    :param name: client cache key
+    :param factory: callable without arguments, which creates client
+    :return: client object
+    """
+    with _shared_clients_lock:
+        if name not in _shared_clients:
+            _shared_clients[name] = factory()
+        return _shared_clients[name]
+
 
 def type_google(file_name: str):
+    setup = google_recognition_setup(file_name)
+    if 'error' in setup:
+        return setup
+
+    client = setup['client']
+    types = setup['types']
+    config = setup['config']
+    audio_info = setup['audio_info']
+    file_name = setup['file_name']
+
+    try:
+        if GoogleASR.streaming and audio_info.duration_seconds <= GoogleASR.streaming_max_duration:
+            # Audio is pushed by chunks without GCS upload, results are received while audio is being sent
+            with metrics.span('streaming', bytes=os.path.getsize(file_name)):
+                return get_limiter('google', GoogleASR).call(
+                    lambda: [google_result_to_object(result) for result in
+                             google_streaming_results(client, types, config, file_name)])
+
+        audio, blob = google_recognition_audio(file_name, types, audio_info)
+
+        # Detects speech in the audio file
+        with metrics.span('operation_start'):
+            operation = get_limiter('google', GoogleASR).call(client.long_running_recognize, config, audio)
+
+        try:
+            with metrics.span('operation_wait'):
+                response = operation.result(timeout=GoogleASR.operation_timeout)
+        finally:
+            if blob:
+                get_google_uploader().release_file(blob)
+    finally:
+        if setup['temp_file']:
+            os.remove(setup['temp_file'])
+
+    return google_response_to_strings(response)
+
+
+def get_google_uploader():
+    from .google_streaming import GoogleStorageUploader
+
+    return get_shared_client(
+        'google_storage', lambda: GoogleStorageUploader(GoogleASR.project_name, GoogleASR.api_data['project_id']))
+
+
+def google_recognition_setup(file_name: str):
+    """
+    Prepare Google client and recognition config for file. If GoogleASR.transcode is set, file is transcoded
+    to compact format at first and "temp_file" must be removed after recognition
+    :return: dict with "client", "types", "config", "audio_info", "file_name" and "temp_file" keys
+             or dict with "error" key
+    :rtype: dict
+    """
     GoogleASR.load_variables()
 
     google_libs = GoogleASR.get_libs()
-    speech = google_libs.speech
     enums = google_libs.enums
     types = google_libs.types
 
-    google_client = GoogleStorageUploader(GoogleASR.project_name, GoogleASR.api_data['project_id'])
-    phrases_hints = [speech.types.SpeechContext(
-        phrases=GoogleASR.phrases_list)]
-
     file_name = os.path.abspath(file_name)
-    audio_info = AudioSegment.from_file(file_name)
+    audio_info = AudioProbe.get_info(file_name)
+    temp_file = None
+
+    if GoogleASR.transcode and needs_transcoding(audio_info):
+        with metrics.span('transcode', format=GoogleASR.transcode) as attributes:
+            file_name, audio_info = transcode_file(file_name, audio_info, GoogleASR.transcode)
+            attributes['bytes'] = os.path.getsize(file_name)
+        temp_file = file_name
 
-    mime = magic.Magic(mime=True)
-    content_type = mime.from_file(file_name)
+    content_type = audio_info.mime
 
     # Instantiates a client
-    client = speech.SpeechClient()
+    client = get_google_client()
 
     amr_encoding = enums.RecognitionConfig.AudioEncoding.AMR
 
@@ -42,53 +126,62 @@ def type_google(file_name: str):
             amr_encoding = enums.RecognitionConfig.AudioEncoding.AMR_WB
 
     allowed_formats = {
-        'audio/x-wav': types.RecognitionConfig(
-            encoding=enums.RecognitionConfig.AudioEncoding.LINEAR16,
-            sample_rate_hertz=audio_info.frame_rate,
-            speech_contexts=phrases_hints,
-            language_code=GoogleASR.language_code),
-        'audio/ogg': types.RecognitionConfig(
-            encoding=enums.RecognitionConfig.AudioEncoding.OGG_OPUS,
-            sample_rate_hertz=audio_info.frame_rate,
-            speech_contexts=phrases_hints,
-            language_code=GoogleASR.language_code),
-        'video/ogg': types.RecognitionConfig(
-            encoding=enums.RecognitionConfig.AudioEncoding.OGG_OPUS,
-            sample_rate_hertz=audio_info.frame_rate,
-            speech_contexts=phrases_hints,
-            language_code=GoogleASR.language_code),
-        'audio/flac': types.RecognitionConfig(
-            encoding=enums.RecognitionConfig.AudioEncoding.FLAC,
-            sample_rate_hertz=audio_info.frame_rate,
-            speech_contexts=phrases_hints,
-            language_code=GoogleASR.language_code),
-        'audio/amr': types.RecognitionConfig(
-            encoding=amr_encoding,
-            sample_rate_hertz=audio_info.frame_rate,
-            speech_contexts=phrases_hints,
-            language_code=GoogleASR.language_code)
+        'audio/x-wav': enums.RecognitionConfig.AudioEncoding.LINEAR16,
+        'audio/ogg': enums.RecognitionConfig.AudioEncoding.OGG_OPUS,
+        'video/ogg': enums.RecognitionConfig.AudioEncoding.OGG_OPUS,
+        'audio/flac': enums.RecognitionConfig.AudioEncoding.FLAC,
+        'audio/amr': amr_encoding
     }
 
-    blob = None
-
     if content_type in allowed_formats:
-        config = allowed_formats[content_type]
+        config = google_recognition_config(allowed_formats[content_type], audio_info.frame_rate,
+                                           audio_info.channels)
     else:
         return {
             'error': 'Unsupported audio format or count of audio channels is more than 1.'
-                     'If you want to use more channels, type --use-beta=1'}
-    if audio_info.duration_seconds < 60:
-        # Loads the audio into memory
-        with io.open(file_name, 'rb') as audio_file:
-            content = audio_file.read()
-            audio = types.RecognitionAudio(content=content)
-    else:
-        blob = google_client.upload_file(file_name)
-        audio = {'uri': "gs://" + blob.bucket.name + "/" + blob.name}
+                     'If you want to use more channels, type --use-beta=1. '
+                     'To recognize other formats, type --google-transcode=flac'}
+
+    return {
+        'client': client,
+        'types': types,
+        'config': config,
+        'audio_info': audio_info,
+        'file_name': file_name,
+        'temp_file': temp_file
+    }
+
+
+def get_google_client():
+    """
+    :return: process-wide SpeechClient of configured API version
+    """
+    speech = GoogleASR.get_libs().speech
+    return get_shared_client('google_speech_beta' if GoogleASR.use_beta else 'google_speech', speech.SpeechClient)
+
+
+def google_recognition_config(encoding, sample_rate_hertz: int, channels=1):
+    """
+    Get RecognitionConfig with phrase hints and options of GoogleASR
+    :param encoding: RecognitionConfig.AudioEncoding
+    :rtype: RecognitionConfig
+    """
+    google_libs = GoogleASR.get_libs()
+    speech = google_libs.speech
+    types = google_libs.types
+
+    phrases_hints = [speech.types.SpeechContext(
+        phrases=GoogleASR.phrases_list)]
+
+    config = types.RecognitionConfig(
+        encoding=encoding,
+        sample_rate_hertz=sample_rate_hertz,
+        speech_contexts=phrases_hints,
+        language_code=GoogleASR.language_code)
 
     config.enable_word_time_offsets = True
     config.enable_separate_recognition_per_channel = GoogleASR.split_by_channels
-    config.audio_channel_count = audio_info.channels
+    config.audio_channel_count = channels
 
     if GoogleASR.use_beta:
         config.enable_word_confidence = GoogleASR.confidence
@@ -99,59 +192,112 @@ def type_google(file_name: str):
             if GoogleASR.diarization_speaker_count > 0:
                 config.diarization_speaker_count = GoogleASR.diarization_speaker_count
 
-    # Detects speech in the audio file
-    operation = client.long_running_recognize(config, audio)
+    return config
+
+
+def google_recognition_audio(file_name: str, types, audio_info):
+    """
+    Get RecognitionAudio for long running recognition. Files longer than 60 seconds are uploaded to GCS
+    :return: RecognitionAudio and uploaded Blob (or None)
+    :rtype: tuple
+    """
+    blob = None
+    size = os.path.getsize(file_name)
+
+    if audio_info.duration_seconds < 60:
+        # Loads the audio into memory
+        with io.open(file_name, 'rb') as audio_file:
+            content = audio_file.read()
+            audio = types.RecognitionAudio(content=content)
+        metrics.count('sent_bytes', size)
+    else:
+        with metrics.span('upload', bytes=size):
+            blob = get_google_uploader().upload_file(file_name)
+        audio = {'uri': "gs://" + blob.bucket.name + "/" + blob.name}
+        metrics.count('uploaded_bytes', size)
+
+    return audio, blob
+
+
+def google_response_to_strings(response):
     strings = []
 
-    response = operation.result(timeout=1000)
-
-    for result in response.results:
-        alternative = result.alternatives[0]
-        text = alternative.transcript
-
-        words = []
-
-        for word_info in alternative.words:
-            word = word_info.word
-            start_time = word_info.start_time
-            end_time = word_info.end_time
-
-            word_object_to_append = {
-                'word': word,
-                'start_time': {
-                    'seconds': start_time.seconds,
-                    'nanos': start_time.nanos
-                },
-                'end_time': {
-                    'seconds': end_time.seconds,
-                    'nanos': end_time.nanos
-                }
-            }
+    with metrics.span('assembly'):
+        for result in response.results:
+            strings.append(google_result_to_object(result))
+
+    return strings
+
 
-            if GoogleASR.use_beta:
-                if GoogleASR.confidence and hasattr(word_info, 'confidence'):
-                    word_object_to_append['confidence'] = word_info.confidence
+def google_streaming_results(client, types, config, audio, interim_results=False):
+    """
+    Recognize audio with StreamingRecognize and yield results as soon as they are received
+    :param client: SpeechClient
+    :param types: Google types module
+    :param config: RecognitionConfig
+    :param audio: path to file, bytes-like object, file-like object or iterable of bytes
+    :param interim_results: yield not final results too
+    :return: generator of StreamingRecognitionResult
+    """
+    streaming_config = types.StreamingRecognitionConfig(config=config, interim_results=interim_results)
+    requests_iterator = (types.StreamingRecognizeRequest(audio_content=data)
+                         for data in iter_chunks(audio, GoogleASR.streaming_chunk_size))
+
+    for response in client.streaming_recognize(streaming_config, requests_iterator):
+        if response.error.code:
+            raise IOError(response.error.message)
 
-            words.append(word_object_to_append)
+        for result in response.results:
+            if (result.is_final or interim_results) and result.alternatives:
+                yield result
 
-        text_object = {
-            'text': text,
-            'words': words
+
+def google_result_to_object(result):
+    """
+    Convert Google recognition result into output object
+    :rtype: dict
+    """
+    alternative = result.alternatives[0]
+    text = alternative.transcript
+
+    words = []
+
+    for word_info in alternative.words:
+        word = word_info.word
+        start_time = word_info.start_time
+        end_time = word_info.end_time
+
+        word_object_to_append = {
+            'word': word,
+            'start_time': {
+                'seconds': start_time.seconds,
+                'nanos': start_time.nanos
+            },
+            'end_time': {
+                'seconds': end_time.seconds,
+                'nanos': end_time.nanos
+            }
         }
 
         if GoogleASR.use_beta:
-            if GoogleASR.confidence and hasattr(alternative, 'confidence'):
-                text_object['confidence'] = alternative.confidence
+            if GoogleASR.confidence and hasattr(word_info, 'confidence'):
+                word_object_to_append['confidence'] = word_info.confidence
+
+        words.append(word_object_to_append)
 
-        if GoogleASR.split_by_channels and hasattr(result, 'channel_tag'):
-            text_object['channel_tag'] = result.channel_tag
+    text_object = {
+        'text': text,
+        'words': words
+    }
 
-        strings.append(text_object)
+    if GoogleASR.use_beta:
+        if GoogleASR.confidence and hasattr(alternative, 'confidence'):
+            text_object['confidence'] = alternative.confidence
 
-    if blob:
-        google_client.delete_file(blob)
+    if GoogleASR.split_by_channels and hasattr(result, 'channel_tag'):
+        text_object['channel_tag'] = result.channel_tag
 
-    return strings
+    return text_object
 
 
 def read_audio(file_name):
@@ -161,15 +307,29 @@ def read_audio(file_name):
     return audio
 
 
-def split_by_ffmpeg(input_file: str, noise_level=-30, duration=0.5, search_text="[silencedetect"):
+def split_by_ffmpeg(input_file: str, single_pass=None, config=YandexASR):
     """
-    Split audio file by silence and get all silence parts and audio parts duration
-    :param input_file:
-    :param noise_level:
-    :param duration:
-    :param search_text:
-    :return:
+    Split audio file into speech segments. File is decoded once and segments are found by voice activity
+    detection (lib.vad) with exact sample offsets
+    :param input_file: path to media file
+    :param single_pass: return parts in "audio" key as memoryview slices of decoded PCM instead of temp files
+                        cut by ffmpeg in "file_name" key, by default YandexASR.single_pass_split is used
+    :param config: config class with vad_* settings
+    :return: list of audio parts
+    :rtype: list
     """
+    if single_pass is None:
+        single_pass = YandexASR.single_pass_split
+
+    sample_rate = YandexASR.sample_rate_hertz
+    pcm = decode_pcm(input_file, sample_rate)
+
+    if single_pass:
+        return split_pcm(pcm, sample_rate, config)
+
+    with metrics.span('silence_detection', bytes=len(pcm)):
+        segments = detect_speech(pcm, sample_rate, config)
+
     current_dir_path = os.path.dirname(os.path.realpath(__file__))
     dir_name = os.path.abspath(current_dir_path + "/../temp")
     base_name = os.path.splitext(os.path.basename(input_file))[0]
@@ -178,159 +338,228 @@ def split_by_ffmpeg(input_file: str, noise_level=-30, duration=0.5, search_text=
     if not os.path.isdir(os.path.abspath(dir_name)) or not os.path.exists(os.path.abspath(dir_name)):
         os.mkdir(os.path.abspath(dir_name))
 
-    # Get silence from audio
-    get_silence_command = [
-        r'ffmpeg',
-        '-i', input_file,
-        '-af', 'silencedetect=noise=' + str(noise_level) + "dB:d=" + str(duration),
-        '-f', 'null',
-        '-'
-    ]
-
-    proc = subprocess.Popen(get_silence_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    out, err = proc.communicate()
-
-    text = err.decode("utf-8")
-    lines = text.split("\n")
-
-    parts = []
-    index = 0
-
-    for line in lines:
-        if search_text in line:
-            values_list = line.split("] ")
-            data = values_list[1]
-            if "start" in data:
-                val_list = data.split(": ")
-                value = val_list[1]
-                parts.append({"start": value})
-            elif "end" in data:
-                val_list = data.split(" | ")
-                vals = val_list[0]
-                val_list = vals.split(": ")
-                value = val_list[1]
-                parts[index]["end"] = value
-                index += 1
-
     file_parts = []
 
-    index = 0
-    while index < len(parts):
-        idx = str(index + 1)
-        split_command = None
-        start = 0
-
-        if index == 0 and float(parts[index]['start']) > 0:
-            start = 0
-            end = float(parts[index]['start'])
-            split_command2 = [
-                r'ffmpeg',
-                '-ss', str(start),
-                '-t', str(end),
-                '-i', input_file,
-                tmp_file_audio + str(index) + ".wav"
-            ]
-            proc_opened = subprocess.Popen(split_command2, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            proc_opened.communicate()
-            file_parts.append({
-                "index": index,
-                "file_name": tmp_file_audio + str(index) + ".wav",
-                "start": 0,
-                "end": end
-            })
-
-        if index + 1 < len(parts):
-            start = float(parts[index]['end']) - 0.25
-            end = float(parts[index + 1]['start']) - float(parts[index]['end']) + 2 * 0.25
-            split_command = [
-                r'ffmpeg',
-                '-ss', str(start),
-                '-t', str(end),
-                '-i', input_file,
-                tmp_file_audio + idx + ".wav"
-            ]
-        elif 'end' in parts[index]:
-            start = float(parts[index]['end']) - 0.25
-            split_command = [
-                r'ffmpeg',
-                '-ss', str(start),
-                '-i', input_file,
-                tmp_file_audio + idx + ".wav"
-            ]
-
-        index += 1
-
-        if split_command:
+    with metrics.span('cut') as attributes:
+        for index, (start, end) in enumerate(segments, 1):
+            part_file_name = tmp_file_audio + str(index) + ".wav"
+
+            split_command = [r'ffmpeg', '-ss', str(start / float(sample_rate)),
+                             '-t', str((end - start) / float(sample_rate)), '-i', input_file, part_file_name]
+
             proc_opened = subprocess.Popen(split_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
             proc_opened.communicate()
-            file_parts.append({
-                "index": int(idx),
-                "file_name": tmp_file_audio + idx + ".wav",
-                "start": str(start),
-            })
 
+            file_parts.append(audio_part(index, start, end, sample_rate, file_name=part_file_name))
+        attributes['segments'] = len(file_parts)
+
+    metrics.count('segments', len(file_parts))
     return file_parts
 
 
+def split_pcm(pcm, sample_rate: int, config=GlobalConfig):
+    """
+    Split decoded mono PCM into speech segments
+    :param config: config class with vad_* settings
+    :return: list of audio parts, "audio" key contains memoryview slice of PCM
+    :rtype: list
+    """
+    pcm = memoryview(pcm)
+    with metrics.span('silence_detection', bytes=len(pcm)) as attributes:
+        segments = detect_speech(pcm, sample_rate, config)
+        audio_parts = [audio_part(index, start, end, sample_rate,
+                                  audio=pcm[start * SAMPLE_WIDTH:end * SAMPLE_WIDTH])
+                       for index, (start, end) in enumerate(segments, 1)]
+        attributes['segments'] = len(audio_parts)
+
+    metrics.count('segments', len(audio_parts))
+    return audio_parts
+
+
+def audio_part(index: int, start: int, end: int, sample_rate: int, **part):
+    """
+    Build audio part object in split_by_ffmpeg output format
+    :param index: number of part
+    :param start: first sample of part
+    :param end: sample after the last one
+    :param part: audio part source ("file_name" or "audio")
+    :rtype: dict
+    """
+    part['index'] = index
+    part['start'] = str(start / float(sample_rate)) if start else 0
+    part['start_sample'] = start
+    part['end_sample'] = end
+
+    return part
+
+
 def type_wit(file_name: str):
     WitASR.load_variables()
 
     file_name = os.path.abspath(file_name)
+    audio_info = AudioProbe.get_info(file_name)
+
+    if audio_info.duration_seconds > WitASR.max_duration:
+        return type_wit_chunked(file_name)
+
     # reading audio
     audio = read_audio(file_name)
 
-    audio_info = AudioSegment.from_file(file_name)
+    headers = wit_request_headers(audio_info)
+    if 'error' in headers:
+        return headers
+
+    # making an HTTP post request over pooled keep-alive connection
+    content = get_limiter('wit', WitASR).call(wit_post, headers, audio)
+
+    return wit_content_result(content)
+
+
+def wit_post(headers: dict, audio: bytes):
+    """
+    Send audio to Wit
+    :return: response body
+    :rtype: str
+    """
+    with metrics.span('request', bytes=len(audio)):
+        resp = get_session('wit').post(WitASR.API_ENDPOINT, headers=headers, data=audio, timeout=HttpConfig.timeout)
+    metrics.count('sent_bytes', len(audio))
+    if resp.status_code == 429:
+        retry_after = resp.headers.get('Retry-After')
+        raise QuotaError('Wit rate limit is exceeded',
+                         float(retry_after) if retry_after and retry_after.isdigit() else None)
+
+    return resp.content.decode("utf-8")
 
+
+def wit_request_headers(audio_info):
+    """
+    Get HTTP headers for Wit recognition of file
+    :return: dict with headers or dict with "error" key
+    :rtype: dict
+    """
     available_content_types = {
         "audio/x-mpeg-3": "audio/mpeg3",
         "audio/x-wav": "audio/wav",
         "audio/ulaw": "audio/ulaw"
     }
 
-    mime = magic.Magic(mime=True)
-    content_type = mime.from_file(file_name)
+    content_type = audio_info.mime
 
     if content_type in available_content_types:
         content_type = available_content_types[content_type]
     else:
         return {'error': "Unsupported audio format"}
 
-    if audio_info.duration_seconds > 13:
-        return {'error': 'Files with duration more than 13 seconds are not supported yet'}
+    if audio_info.duration_seconds > WitASR.max_duration:
+        return {'error': 'Files with duration more than {0!s} seconds must be sent by chunks'.format(
+            WitASR.max_duration)}
 
     # defining headers for HTTP request
+    return {'authorization': 'Bearer ' + WitASR.access_token,
+            'Content-Type': content_type}
+
+
+def type_wit_chunked(file_name: str, config=WitASR):
+    """
+    Recognize long file with Wit. File is cut by silence into chunks, which fit Wit duration limit,
+    chunks are sent concurrently and their texts are merged with time offsets
+    :param config: config class with vad_* and segment_* settings
+    :rtype: list
+    """
+    pcm = decode_pcm(file_name, WitASR.sample_rate_hertz)
+    # Parts are packed and cut to WitASR.segment_max_duration
+    chunks = split_pcm(pcm, WitASR.sample_rate_hertz, config)
+
+    limiter = get_limiter('wit', WitASR)
     headers = {'authorization': 'Bearer ' + WitASR.access_token,
-               'Content-Type': content_type}
+               'Content-Type': 'audio/wav'}
+
+    def recognize_chunk(chunk):
+        try:
+            content = limiter.call(wit_post, headers, wav_bytes(chunk['audio'], WitASR.sample_rate_hertz))
+            result = wit_content_result(content)
+            error = result.get('error') if isinstance(result, dict) else None
+        except Exception as err:
+            error = err
+
+        if error is not None:
+            return {'error': "Caught error \"{0!s}\" in Wit recognition of part {1!s}".format(error, chunk['index'])}
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, WitASR.max_concurrent_requests)) as executor:
+        results = list(executor.map(metrics.bind(recognize_chunk), chunks))
 
-    # making an HTTP post request
-    resp = requests.post(WitASR.API_ENDPOINT, headers=headers,
-                         data=audio)
+    # Text of failed chunk would be silently lost, so the whole file is failed
+    errors = [result for result in results if isinstance(result, dict)]
+    if errors:
+        return errors[0]
 
+    return audio_parts_to_strings(chunks, [result[0]['text'] for result in results])
+
+
+def wit_content_result(content: str):
+    """
+    Convert Wit response body into result. Body, which isn't JSON (errors of proxies and 5xx pages), is an error
+    :rtype: list or dict
+    """
     # converting response content to JSON format
-    data = json.loads(resp.content.decode("utf-8"))
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return {'error': 'Unexpected Wit response: ' + content[:200]}
+
+    if not isinstance(data, dict):
+        return {'error': 'Unexpected Wit response: ' + content[:200]}
+
+    return wit_result(data)
 
-    # get text from data
-    if not '_text' in data and 'error' in data:
-        return {'error': data['error']}
+
+def wit_result(data: dict):
+    # get text from data, it is returned in the same format as texts of chunked recognition
+    if not '_text' in data:
+        return {'error': data.get('error', 'Unexpected Wit response without text')}
     else:
-        return [data['_text']]
+        return [{
+            "text": data['_text'],
+            "audio_part_start_time": 0
+        }]
+
 
+def get_yandex_iam():
+    """
+    Get IAM token from process-wide token provider, which refreshes it in background
+    :rtype: str
+    """
+    from .ysk.stt_lib import YandexIAM, YandexIAMTokenProvider
 
-def type_yandex(file_name: str):
     YandexASR.load_variables()
 
-    iam_key = YandexIAM.get_iam()
+    token_provider = get_shared_client('yandex_iam', lambda: YandexIAMTokenProvider(
+        YandexIAM(YandexASR.service_account_id, YandexASR.key_id, YandexASR.private_cert)))
+
+    return token_provider.get_token()
+
+
+def type_yandex(file_name: str, split_by_silence=None, config=YandexASR):
+    """
+    :param split_by_silence: recognize speech segments separately, by default YandexASR.split_by_silence is used
+    :param config: config class with vad_* and segment_* settings
+    """
+    from .ysk.stt_lib import YandexSTT
+
+    if split_by_silence is None:
+        split_by_silence = YandexASR.split_by_silence
 
-    if not iam_key:
-        yandex_iam = YandexIAM(YandexASR.service_account_id, YandexASR.key_id, YandexASR.private_cert)
-        iam = yandex_iam.generate_iam()
-        yandex_iam.save_iam(iam)
-        iam_key = iam['iamToken']
+    try:
+        iam_key = get_yandex_iam()
+    except IOError as err:
+        return {'error': str(err)}
 
     file = os.path.abspath(file_name)
 
-    if YandexASR.split_by_silence:
-        audio_parts = split_by_ffmpeg(file)
+    if split_by_silence:
+        audio_parts = split_by_ffmpeg(file, config=config)
         delete = True
     else:
         audio_parts = [{
@@ -340,20 +569,252 @@ def type_yandex(file_name: str):
         }]
         delete = False
 
-    strings = []
-    for audio_file in audio_parts:
+    limiter = get_limiter('yandex', YandexASR)
+
+    def recognize_part(audio_file):
         try:
-            text = YandexSTT.run(YandexASR.folder_id, iam_key, audio_file['file_name'], YandexASR.language_code)
+            if 'audio' in audio_file:
+                # Parts of decoded PCM
+                with metrics.span('streaming', part=audio_file['index'], bytes=len(audio_file['audio'])):
+                    text = limiter.call(YandexSTT.run, YandexASR.folder_id, iam_key, audio_file['audio'],
+                                        YandexASR.language_code, audio_encoding='LINEAR16_PCM',
+                                        sample_rate_hertz=YandexASR.sample_rate_hertz)
+                metrics.count('sent_bytes', len(audio_file['audio']))
+                return text
+
+            with metrics.span('streaming', part=audio_file['index']):
+                return limiter.call(YandexSTT.run, YandexASR.folder_id, iam_key, audio_file['file_name'],
+                                    YandexASR.language_code)
+        except Exception as err:
+            return {'error': "Caught error \"{0!s}\" in Yandex recognition of part {1!s}".format(
+                err, audio_file['index'])}
+        finally:
+            if delete and 'file_name' in audio_file:
+                os.remove(audio_file['file_name'])
 
-            if text != "":
+    # All parts are streamed concurrently over one shared channel
+    with ThreadPoolExecutor(max_workers=max(1, YandexASR.max_concurrent_streams)) as executor:
+        texts = list(executor.map(metrics.bind(recognize_part), audio_parts))
+
+    # Text of failed part would be silently lost, so the whole file is failed
+    errors = [text for text in texts if isinstance(text, dict)]
+    if errors:
+        return errors[0]
+
+    return audio_parts_to_strings(audio_parts, texts)
+
+
+def audio_parts_to_strings(audio_parts: list, texts: list):
+    """
+    Merge texts of audio parts in order of their start time
+    :rtype: list
+    """
+    strings = []
+    with metrics.span('assembly'):
+        for audio_file, text in sorted(zip(audio_parts, texts), key=lambda part: float(part[0]['start'])):
+            if text:
                 strings.append({
                     "text": text,
                     "audio_part_start_time": audio_file['start']
                 })
-        except Exception as error:
-            err = str(error)
-        finally:
-            if delete:
-                os.remove(audio_file['file_name'])
 
     return strings
+
+
+recognition_methods = {
+    'yandex': type_yandex,
+    'google': type_google,
+    'wit': type_wit
+}
+
+recognition_configs = {
+    'yandex': YandexASR,
+    'google': GoogleASR,
+    'wit': WitASR
+}
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """
+    Get result cache configured by CacheConfig
+    :return: ResultCache or None, if cache is disabled
+    """
+    global _result_cache
+
+    if not CacheConfig.enabled:
+        return None
+
+    with _result_cache_lock:
+        if _result_cache is None or _result_cache.file_name != os.path.abspath(CacheConfig.file_name):
+            _result_cache = ResultCache(CacheConfig.file_name, CacheConfig.max_entries, CacheConfig.max_size_bytes,
+                                        CacheConfig.ttl_seconds)
+        return _result_cache
+
+
+def recognize_utterances(file_name: str, method_name: str):
+    """
+    Recognize file, so every item of result has its own start time. Yandex and Wit return no word times,
+    so their audio is split by silence into separate utterances, which aren't packed into one request
+    :rtype: list or dict
+    """
+    if method_name == 'google':
+        return type_google(file_name)
+
+    config = recognition_configs[method_name]
+    utterance_config = type(config.__name__, (config,), {'segment_target_duration': 0})
+
+    if method_name == 'yandex':
+        return type_yandex(file_name, split_by_silence=True, config=utterance_config)
+
+    WitASR.load_variables()
+    return type_wit_chunked(file_name, utterance_config)
+
+
+def recognize_channels(file_name: str, method_name: str):
+    """
+    Demux channels once and recognize every channel concurrently with any method. Every channel is recognized
+    by utterances (see recognize_utterances), so the dialog can be ordered by their start time
+    :return: time-ordered dialog with channel number of every utterance or dict with "error" key
+    """
+    with metrics.span('demux'):
+        channels_pcm, sample_rate = demux_channels(file_name)
+
+    current_dir_path = os.path.dirname(os.path.realpath(__file__))
+    dir_name = os.path.abspath(current_dir_path + "/../temp")
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+
+    base_name = os.path.splitext(os.path.basename(file_name))[0]
+    channel_files = []
+    for channel, pcm in enumerate(channels_pcm, 1):
+        channel_file = dir_name + "/tmp_" + str(uuid4()) + "_" + base_name + "_channel" + str(channel) + ".wav"
+        write_wav(channel_file, pcm, sample_rate)
+        channel_files.append(channel_file)
+
+    try:
+        with ThreadPoolExecutor(max_workers=len(channel_files)) as executor:
+            results = list(executor.map(metrics.bind(partial(recognize_utterances, method_name=method_name)),
+                                        channel_files))
+    finally:
+        for channel_file in channel_files:
+            os.remove(channel_file)
+
+    with metrics.span('assembly'):
+        return merge_channel_results([result or [] for result in results])
+
+
+def is_good_result(result):
+    return bool(result) and not (isinstance(result, dict) and 'error' in result)
+
+
+def recognize_method(file_object: str, type_name: str):
+    """
+    Recognize existing file with one method
+    """
+    with metrics.provider(type_name), metrics.span('recognition', bytes=os.path.getsize(file_object)):
+        cache = get_result_cache()
+        if cache:
+            with metrics.span('cache_lookup'):
+                cache_key = ResultCache.make_key(file_object, type_name,
+                                                 recognition_configs[type_name].get_settings())
+                cached_result = cache.get(cache_key)
+            if cached_result:
+                metrics.count('cache_hits')
+                return cached_result
+
+        metrics.count('recognitions')
+        try:
+            if GlobalConfig.demux_channels:
+                result = recognize_channels(file_object, type_name)
+            else:
+                result = recognition_methods[type_name](file_object)
+        except CredentialsError as err:
+            result = {'error': str(err)}
+        if not result:
+            metrics.count('recognition_errors')
+            return {'error': 'Empty result was returned'}
+        else:
+            if not is_good_result(result):
+                metrics.count('recognition_errors')
+            elif cache:
+                cache.put(cache_key, result)
+            return result
+
+
+def recognize_method_safe(file_object: str, type_name: str):
+    try:
+        return recognize_method(file_object, type_name)
+    except (Exception, SystemExit) as err:
+        return {'error': "Caught error \"{0!s}\" in {1!s} recognition".format(err, type_name)}
+
+
+def recognize_multi(file_object: str, methods: list):
+    """
+    Recognize file with several methods in GlobalConfig.multi_method_mode:
+    fallback - methods are called one by one in priority order until non-empty result,
+    race - all methods are started at once and the first good result is returned,
+    hedge - next method is started when previous one failed or didn't answer in GlobalConfig.hedge_delay seconds.
+    Methods, which are still running when result is returned, are abandoned
+    :return: the first good result or the last error
+    """
+    if GlobalConfig.multi_method_mode == 'fallback':
+        result = None
+        for type_name in methods:
+            result = recognize_method_safe(file_object, type_name)
+            if is_good_result(result):
+                return result
+        return result
+
+    delay = 0 if GlobalConfig.multi_method_mode == 'race' else GlobalConfig.hedge_delay
+    results = queue.Queue()
+    started = 0
+    finished = 0
+    result = {'error': 'Empty result was returned'}
+
+    def run(type_name):
+        results.put(recognize_method_safe(file_object, type_name))
+
+    while True:
+        # Race starts all methods at once, hedge starts next method on timeout or after failure.
+        # Methods run in daemon threads, so abandoned methods don't keep the process alive after result is returned
+        while started < len(methods):
+            threading.Thread(target=metrics.bind(run), args=(methods[started],), daemon=True).start()
+            started += 1
+            if delay > 0:
+                break
+
+        if finished == started:
+            break
+
+        timeout = delay if delay > 0 and started < len(methods) else None
+        try:
+            result = results.get(timeout=timeout)
+        except queue.Empty:
+            continue
+
+        finished += 1
+        if is_good_result(result):
+            return result
+
+    return result
+
+
+def recognize(file_name, method_name):
+    try:
+        file_object = os.path.abspath(file_name)
+        if not os.path.isfile(file_object):
+            raise IOError(errno.ENOENT, "File doesn't exists", file_object)
+    except IOError as err:
+        return {'error': "Caught error \"" + err.strerror + "\" in file " + err.filename}
+
+    methods = [type_name.strip() for type_name in method_name.split(',')]
+
+    if all(type_name in recognition_methods for type_name in methods):
+        if len(methods) > 1:
+            return recognize_multi(file_object, methods)
+        return recognize_method(file_object, methods[0])
+    else:
+        return {'error': 'Unknown recognition method'}
@@ -0,0 +1,120 @@
+import json
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from . import metrics
+from .credentials import ServerConfig, MetricsConfig
+from .recognizers import recognize, recognition_configs, get_google_client, get_google_uploader, get_yandex_iam
+
+
+def warm_up(methods: list):
+    """
+    Load credentials and create clients, channels and tokens before the first request
+    :param methods: recognition methods, which will be used
+    """
+    for method_name in methods:
+        recognition_configs[method_name].load_variables()
+
+        if method_name == 'google':
+            get_google_client()
+            get_google_uploader()
+        elif method_name == 'yandex':
+            from .ysk.stt_lib import YandexSTT
+
+            get_yandex_iam()
+            YandexSTT.get_channel()
+
+
+class RecognitionRequestHandler(BaseHTTPRequestHandler):
+    """Handler of recognition jobs.
+
+        POST /recognize with JSON body {"file": "/path/to/file", "method": "google"} returns the same JSON
+        as recognizer.py, with "timings": true the result is returned with spans of pipeline stages.
+        GET /health returns {"status": "ok"}, GET /metrics returns metrics in Prometheus text format.
+        """
+
+    def do_GET(self):
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            body = metrics.registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(404, {'error': 'Unknown path'})
+
+    def do_POST(self):
+        if self.path != '/recognize':
+            self.send_json(404, {'error': 'Unknown path'})
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            job = json.loads(self.rfile.read(length).decode("utf-8"))
+            file_name = job['file']
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {'error': 'Request body must be JSON object with "file" key'})
+            return
+
+        with self.server.workers, metrics.trace() as job_trace:
+            try:
+                result = recognize(file_name, job.get('method', self.server.method))
+            except (Exception, SystemExit) as err:
+                result = {'error': "Caught error \"{0!s}\" in file {1!s}".format(err, file_name)}
+
+        if job.get('timings', MetricsConfig.timings):
+            result = {'result': result, 'timings': job_trace.to_dict()}
+
+        self.send_json(200, result)
+
+    def send_json(self, code: int, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # stdout is reserved for JSON output
+        pass
+
+
+class RecognitionServer(ThreadingMixIn, HTTPServer):
+    """Resident recognition server, which keeps credentials, clients, channels and IAM token warm between jobs.
+
+        :type method: str
+        :param method: recognition method for jobs without "method" key
+
+        :type workers: int
+        :param workers: count of simultaneous recognitions, other jobs wait
+        """
+    daemon_threads = True
+
+    def __init__(self, host: str, port: int, method='google', workers=4):
+        HTTPServer.__init__(self, (host, port), RecognitionRequestHandler)
+        self.method = method
+        self.workers = threading.BoundedSemaphore(max(1, workers))
+
+
+def serve(method='google', methods=None):
+    """
+    Warm up clients and serve recognition jobs until process is stopped
+    :param method: default recognition method
+    :param methods: methods to warm up, by default only default method
+    """
+    warm_up(methods or [method])
+
+    server = RecognitionServer(ServerConfig.host, ServerConfig.port, method, ServerConfig.workers)
+    print(json.dumps({'status': 'listening', 'host': ServerConfig.host, 'port': server.server_address[1]}), flush=True)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
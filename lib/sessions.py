@@ -0,0 +1,52 @@
+import threading
+
+from .credentials import HttpConfig
+
+# 429 isn't retried here, rate limit errors are handled by provider limiter (lib.limits)
+RETRY_STATUSES = (500, 502, 503, 504)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def create_retry():
+    """
+    Retry policy with exponential backoff on connection errors and 5xx responses for all methods
+    :rtype: urllib3.util.retry.Retry
+    """
+    from urllib3.util.retry import Retry
+
+    retry_kwargs = {
+        'total': HttpConfig.max_retries,
+        'backoff_factor': HttpConfig.backoff_factor,
+        'status_forcelist': RETRY_STATUSES,
+        'raise_on_status': False
+    }
+
+    try:
+        return Retry(allowed_methods=None, **retry_kwargs)
+    except TypeError:
+        # urllib3 < 1.26
+        return Retry(method_whitelist=False, **retry_kwargs)
+
+
+def get_session(name='default'):
+    """
+    Get shared HTTP session with keep-alive connection pool. Count of connections to one host is limited by
+    HttpConfig.pool_maxsize, requests wait for free connection instead of opening new one
+    :param name: session name, every provider uses its own session
+    :rtype: requests.Session
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=HttpConfig.pool_connections, pool_maxsize=HttpConfig.pool_maxsize,
+                                  max_retries=create_retry(), pool_block=True)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[name] = session
+
+        return _sessions[name]
@@ -0,0 +1,95 @@
+import os
+import subprocess
+from uuid import uuid4
+from concurrent.futures import ThreadPoolExecutor
+
+from .probe import AudioInfo
+
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+
+TRANSCODE_FORMATS = {
+    'flac': {
+        'extension': '.flac',
+        'mime': 'audio/flac',
+        'codec': 'flac',
+        'arguments': ['-c:a', 'flac', '-sample_fmt', 's16']
+    },
+    'ogg_opus': {
+        'extension': '.ogg',
+        'mime': 'audio/ogg',
+        'codec': 'opus',
+        'arguments': ['-c:a', 'libopus', '-application', 'voip', '-b:a', '32k']
+    }
+}
+
+# Codecs (in terms of ffprobe) of formats, which are already compact and accepted by Google as is.
+# Ogg is sent as OGG_OPUS, so Ogg with other codecs (Vorbis, FLAC) is transcoded
+COMPACT_CODECS = {
+    'audio/flac': ('flac',),
+    'audio/ogg': ('opus',),
+    'video/ogg': ('opus',),
+    'audio/amr': ('amr_nb', 'amr_wb')
+}
+
+# ffmpeg is CPU bound, so count of simultaneous transcodings is limited by count of CPUs
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+
+def needs_transcoding(audio_info: AudioInfo):
+    return audio_info.codec not in COMPACT_CODECS.get(audio_info.mime, ())
+
+
+def opus_sample_rate(frame_rate: int):
+    """
+    Get the nearest sample rate supported by Opus, which isn't lower than native one
+    :rtype: int
+    """
+    for sample_rate in OPUS_SAMPLE_RATES:
+        if sample_rate >= frame_rate:
+            return sample_rate
+    return OPUS_SAMPLE_RATES[-1]
+
+
+def transcode_file(file_name: str, audio_info: AudioInfo, audio_format: str):
+    """
+    Transcode file to compact format in worker pool. Channel layout is kept
+    :param file_name: path to source file
+    :param audio_info: source file properties
+    :param audio_format: target format (flac or ogg_opus)
+    :return: path to temp file, which must be removed by caller, and its AudioInfo
+    :rtype: tuple
+    """
+    if audio_format not in TRANSCODE_FORMATS:
+        raise ValueError("Unknown transcoding format " + str(audio_format))
+
+    return _executor.submit(_transcode, file_name, audio_info, audio_format).result()
+
+
+def _transcode(file_name: str, audio_info: AudioInfo, audio_format: str):
+    target = TRANSCODE_FORMATS[audio_format]
+
+    current_dir_path = os.path.dirname(os.path.realpath(__file__))
+    dir_name = os.path.abspath(current_dir_path + "/../temp")
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name, exist_ok=True)
+
+    base_name = os.path.splitext(os.path.basename(file_name))[0]
+    output_file = dir_name + "/tmp_" + str(uuid4()) + "_" + base_name + target['extension']
+
+    sample_rate = audio_info.frame_rate
+    if audio_format == 'ogg_opus':
+        sample_rate = opus_sample_rate(sample_rate)
+
+    transcode_command = [r'ffmpeg', '-v', 'error', '-i', file_name, '-vn', '-ar', str(sample_rate)] + \
+        target['arguments'] + [output_file]
+
+    proc = subprocess.Popen(transcode_command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+
+    if proc.returncode != 0:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise IOError("ffmpeg can't transcode file " + file_name + ": " + err.decode("utf-8", "replace").strip())
+
+    return output_file, AudioInfo(target['mime'], sample_rate, audio_info.channels, audio_info.duration_seconds,
+                                  target['codec'])
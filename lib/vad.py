@@ -0,0 +1,208 @@
+import sys
+import math
+import operator
+from array import array
+
+from .audio import SAMPLE_WIDTH
+from .credentials import GlobalConfig
+
+# NumPy module, None if it isn't installed, False until the first use
+numpy = False
+
+
+def get_numpy():
+    """
+    Import NumPy on the first use, so methods, which don't split audio, don't pay for its import
+    :return: numpy module or None
+    """
+    global numpy
+
+    if numpy is False:
+        try:
+            import numpy as numpy_module
+        except ImportError:
+            numpy_module = None
+        numpy = numpy_module
+
+    return numpy
+
+
+def block_levels(pcm, block_size: int, measure='peak'):
+    """
+    Get level of every block of mono signed 16 bit PCM. NumPy processes all blocks at once, without NumPy blocks
+    are measured one by one in pure Python
+    :param pcm: mono signed 16 bit little-endian PCM
+    :param block_size: count of samples in block, the last block may be shorter
+    :param measure: peak (max absolute amplitude, like ffmpeg silencedetect) or rms
+    :return: numpy array or list of levels
+    """
+    sample_count = len(pcm) // SAMPLE_WIDTH
+    numpy = get_numpy()
+
+    if numpy is None:
+        samples = array('h')
+        samples.frombytes(pcm[:sample_count * SAMPLE_WIDTH])
+        if sys.byteorder == 'big':
+            samples.byteswap()
+
+        blocks = (samples[offset:offset + block_size] for offset in range(0, sample_count, block_size))
+        if measure == 'rms':
+            return [math.sqrt(math.fsum(map(operator.mul, block, block)) / len(block)) for block in blocks]
+        return [max(max(block), -min(block)) for block in blocks]
+
+    samples = numpy.frombuffer(pcm, dtype='<i2', count=sample_count)
+    full_blocks = sample_count // block_size
+    # Full blocks are a view of PCM, the last short block is measured separately
+    blocks = [samples[:full_blocks * block_size].reshape(full_blocks, block_size)]
+    if sample_count % block_size:
+        blocks.append(samples[full_blocks * block_size:].reshape(1, -1))
+
+    if measure == 'rms':
+        return numpy.concatenate([numpy.sqrt(numpy.einsum('ij,ij->i', part, part, dtype=numpy.float64) /
+                                             part.shape[1]) for part in blocks])
+
+    return numpy.concatenate([numpy.maximum(part.max(axis=1).astype(numpy.int32),
+                                            -part.min(axis=1).astype(numpy.int32)) for part in blocks])
+
+
+def voiced_runs(levels, threshold: float):
+    """
+    Find runs of blocks with level above threshold
+    :return: list of [first block, block after the last one]
+    :rtype: list
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        voiced = numpy.asarray(levels) > threshold
+        edges = numpy.flatnonzero(numpy.diff(numpy.concatenate(([False], voiced, [False])).astype(numpy.int8)))
+        return edges.reshape(-1, 2).tolist()
+
+    runs = []
+    run_start = None
+    for index, level in enumerate(levels):
+        if level > threshold:
+            if run_start is None:
+                run_start = index
+        elif run_start is not None:
+            runs.append([run_start, index])
+            run_start = None
+
+    if run_start is not None:
+        runs.append([run_start, len(levels)])
+
+    return runs
+
+
+def quietest_block(levels, first: int, last: int):
+    """
+    :return: index of block with the lowest level in [first, last)
+    :rtype: int
+    """
+    numpy = get_numpy()
+    if numpy is not None:
+        return first + int(numpy.argmin(levels[first:last]))
+
+    window = levels[first:last]
+    return first + window.index(min(window))
+
+
+def merge_runs(runs: list, max_gap: int):
+    """
+    Join runs, which are separated by max_gap blocks or less
+    :rtype: list
+    """
+    merged = []
+    for run in runs:
+        if merged and run[0] - merged[-1][1] <= max_gap:
+            merged[-1][1] = max(merged[-1][1], run[1])
+        else:
+            merged.append(list(run))
+
+    return merged
+
+
+def split_long_runs(runs: list, levels, max_blocks: int):
+    """
+    Cut runs, which are longer than max_blocks, at the quietest block of the second half of every max_blocks window
+    :rtype: list
+    """
+    if max_blocks <= 0:
+        return runs
+
+    limited = []
+    for start, end in runs:
+        while end - start > max_blocks:
+            # Window includes the block after max_blocks, so it isn't empty, when max_blocks is 1
+            cut = quietest_block(levels, start + max(1, max_blocks // 2), start + max_blocks + 1)
+            limited.append([start, cut])
+            start = cut
+        limited.append([start, end])
+
+    return limited
+
+
+def pack_runs(runs: list, target_blocks: int, max_blocks=0):
+    """
+    Join adjacent runs with pauses between them while joined run fits target_blocks (and max_blocks),
+    so short utterances are sent in one request
+    :rtype: list
+    """
+    if target_blocks <= 0 or not runs:
+        return runs
+
+    limit = min(target_blocks, max_blocks) if max_blocks > 0 else target_blocks
+
+    packed = [list(runs[0])]
+    for start, end in runs[1:]:
+        if end - packed[-1][0] <= limit:
+            packed[-1][1] = end
+        else:
+            packed.append([start, end])
+
+    return packed
+
+
+def detect_speech(pcm, sample_rate: int, config=GlobalConfig):
+    """
+    Find speech segments in mono signed 16 bit PCM by level of short blocks. Pauses shorter than vad_min_silence
+    are kept inside segments, segments are extended by vad_padding, joined if they are closer than vad_merge_gap
+    and dropped if they are shorter than vad_min_speech. Segments longer than vad_max_segment,
+    segment_max_duration or segment_max_bytes of PCM are cut at the quietest point, then adjacent segments
+    are packed up to segment_target_duration
+    :param pcm: mono signed 16 bit little-endian PCM
+    :param sample_rate: sample rate of PCM
+    :param config: config class with vad_* and segment_* settings
+    :return: list of [start sample, end sample). If there is no speech, the whole audio is one segment
+    :rtype: list
+    """
+    sample_count = len(pcm) // SAMPLE_WIDTH
+    if not sample_count:
+        return []
+
+    block_size = max(1, int(sample_rate * config.vad_block_duration))
+    block_duration = block_size / float(sample_rate)
+
+    def blocks(seconds):
+        return int(round(seconds / block_duration))
+
+    levels = block_levels(pcm, block_size, config.vad_measure)
+    threshold = 32767 * 10 ** (config.vad_threshold / 20.0)
+
+    runs = merge_runs(voiced_runs(levels, threshold), blocks(config.vad_min_silence) - 1)
+    runs = [run for run in runs if run[1] - run[0] >= blocks(config.vad_min_speech)]
+    if runs:
+        padding = blocks(config.vad_padding)
+        runs = [[max(0, start - padding), min(len(levels), end + padding)] for start, end in runs]
+        runs = merge_runs(runs, blocks(config.vad_merge_gap))
+    else:
+        runs = [[0, len(levels)]]
+
+    limits = [limit for limit in (config.vad_max_segment, config.segment_max_duration) if limit > 0]
+    if config.segment_max_bytes > 0:
+        limits.append(config.segment_max_bytes / float(SAMPLE_WIDTH * sample_rate))
+    max_blocks = max(1, blocks(min(limits))) if limits else 0
+
+    runs = split_long_runs(runs, levels, max_blocks)
+    runs = pack_runs(runs, blocks(config.segment_target_duration), max_blocks)
+
+    return [[start * block_size, min(sample_count, end * block_size)] for start, end in runs]
@@ -1,9 +1,14 @@
 import time
 import jwt
-import requests
 import json
 import os
+import threading
 import pytz
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 from datetime import datetime
 from dateutil.parser import parse
 
@@ -11,6 +16,10 @@ import grpc
 
 import lib.ysk.stt_service_pb2 as stt_service_pb2
 import lib.ysk.stt_service_pb2_grpc as stt_service_pb2_grpc
+from lib.audio import iter_chunks, iter_wav_pcm, iter_decoded_pcm
+from lib.probe import AudioProbe
+from lib.credentials import HttpConfig
+from lib.sessions import get_session
 
 
 class YandexIAM:
@@ -50,8 +59,8 @@ class YandexIAM:
     def generate_iam(self):
         encoded_token = self.generate_jwt()
 
-        r = requests.post(self.JWT_URL, data=json.dumps({'jwt': encoded_token}),
-                          headers={"Content-Type": "application/json"})
+        r = get_session('yandex_iam').post(self.JWT_URL, data=json.dumps({'jwt': encoded_token}),
+                                           headers={"Content-Type": "application/json"}, timeout=HttpConfig.timeout)
 
         if isinstance(r.content, bytes):
             content = r.content.decode("utf-8")
@@ -64,73 +73,267 @@ class YandexIAM:
             return {"error": content}
 
     @staticmethod
-    def get_iam():
+    def read_iam_file():
         """
-        Get IAM token or read from JSON file
-        :return: IAM token string
-        :rtype: int
+        Read saved IAM token
+        :return: dict with "iamToken" and "expires" (UNIX time) keys or None
         """
         if os.path.exists(YandexIAM.IAM_FILE_NAME) and os.path.isfile(YandexIAM.IAM_FILE_NAME):
             try:
-                json_iam = json.load(open(YandexIAM.IAM_FILE_NAME, "r"))
+                with open(YandexIAM.IAM_FILE_NAME, "r") as iam_file:
+                    json_iam = json.load(iam_file)
 
                 expires = parse(json_iam['expiresAt']).replace(tzinfo=pytz.UTC)
-                now = datetime.utcnow().replace(tzinfo=pytz.UTC)
-
-                if now < expires:
-                    return json_iam['iamToken']
-                else:
-                    return None
-            except json.JSONDecodeError:
+                return {
+                    'iamToken': json_iam['iamToken'],
+                    'expires': (expires - datetime(1970, 1, 1, tzinfo=pytz.UTC)).total_seconds()
+                }
+            except (ValueError, KeyError, TypeError):
                 return None
 
+    @staticmethod
+    def get_iam():
+        """
+        Get IAM token or read from JSON file
+        :return: IAM token string
+        :rtype: int
+        """
+        json_iam = YandexIAM.read_iam_file()
+
+        if json_iam and time.time() < json_iam['expires']:
+            return json_iam['iamToken']
+        else:
+            return None
+
     @staticmethod
     def save_iam(iam_json_dict: dict):
-        json.dump(iam_json_dict, open(YandexIAM.IAM_FILE_NAME, "w"))
+        """
+        Atomically replace saved IAM token. Error responses are never saved
+        """
+        if 'iamToken' not in iam_json_dict or 'expiresAt' not in iam_json_dict:
+            return False
+
+        tmp_file_name = YandexIAM.IAM_FILE_NAME + "." + str(os.getpid()) + ".tmp"
+        with open(tmp_file_name, "w") as iam_file:
+            json.dump(iam_json_dict, iam_file)
+        os.replace(tmp_file_name, YandexIAM.IAM_FILE_NAME)
+
+        return True
+
+
+class YandexIAMTokenProvider:
+    """Keeps IAM token in memory and refreshes it in background thread before it expires.
+    Refresh is coordinated between processes with lock file, so only one process mints new token
+    and others read it from IAM file.
+
+        :type iam: YandexIAM
+        :param iam: token generator
+
+        :type refresh_margin: int
+        :param refresh_margin: seconds before expiration, when token is refreshed
+        """
+    LOCK_FILE_NAME = YandexIAM.IAM_FILE_NAME + ".lock"
+    RETRY_INTERVAL = 30
+
+    def __init__(self, iam: YandexIAM, refresh_margin=3600):
+        self.iam = iam
+        self.refresh_margin = refresh_margin
+        self.token = None
+        self.expires = 0
+        self.error = None
+        self._refresh_lock = threading.Lock()
+        self._timer = None
+
+    def get_token(self):
+        """
+        Get cached IAM token. Request waits for token only if there is no valid token at all
+        :rtype: str
+        """
+        now = time.time()
+
+        if self.token and now < self.expires:
+            if now >= self.expires - self.refresh_margin:
+                self.refresh_async()
+            return self.token
+
+        with self._refresh_lock:
+            if not self.token or time.time() >= self.expires:
+                self.refresh()
+
+        if not self.token or time.time() >= self.expires:
+            raise IOError("Can't get Yandex IAM token: " + str(self.error))
+
+        return self.token
+
+    def refresh_async(self):
+        """
+        Refresh token in background thread, if it isn't being refreshed already
+        """
+        if self._refresh_lock.acquire(blocking=False):
+            def refresh():
+                try:
+                    self.refresh()
+                finally:
+                    self._refresh_lock.release()
+
+            thread = threading.Thread(target=refresh)
+            thread.daemon = True
+            thread.start()
+
+    def refresh(self):
+        """
+        Load fresh token from IAM file or generate new one. Must be called with refresh lock held
+        """
+        with open(self.LOCK_FILE_NAME, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                json_iam = YandexIAM.read_iam_file()
+
+                if not json_iam or time.time() >= json_iam['expires'] - self.refresh_margin:
+                    try:
+                        iam = self.iam.generate_iam()
+                    except Exception as err:
+                        iam = {'error': str(err)}
+
+                    if YandexIAM.save_iam(iam):
+                        json_iam = YandexIAM.read_iam_file()
+                    else:
+                        self.error = iam.get('error')
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        if json_iam and json_iam['expires'] > self.expires:
+            self.token = json_iam['iamToken']
+            self.expires = json_iam['expires']
+            self.error = None
+
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        if self._timer:
+            self._timer.cancel()
+
+        if self.token and time.time() < self.expires - self.refresh_margin:
+            delay = self.expires - self.refresh_margin - time.time()
+        else:
+            delay = self.RETRY_INTERVAL
+
+        self._timer = threading.Timer(delay, self.refresh_async)
+        self._timer.daemon = True
+        self._timer.start()
 
 
 class YandexSTT:
     CHUNK_SIZE = 16000
+    ENDPOINT = 'stt.api.cloud.yandex.net:443'
+    # Plain text channel is used only for local servers (benchmarks)
+    USE_SSL = True
+    SAMPLE_RATES = (8000, 16000, 48000)
+
+    _channel = None
+    _channel_lock = threading.Lock()
+
+    @staticmethod
+    def get_channel():
+        """
+        Get long-lived secure channel. gRPC multiplexes all streams of the process over this one connection
+        :rtype: grpc.Channel
+        """
+        with YandexSTT._channel_lock:
+            if YandexSTT._channel is None:
+                if YandexSTT.USE_SSL:
+                    cred = grpc.ssl_channel_credentials()
+                    YandexSTT._channel = grpc.secure_channel(YandexSTT.ENDPOINT, cred)
+                else:
+                    YandexSTT._channel = grpc.insecure_channel(YandexSTT.ENDPOINT)
+            return YandexSTT._channel
 
     @staticmethod
-    def gen(folder_id, audio_file_name, language_code: str):
+    def supported_sample_rate(frame_rate: int):
+        """
+        Get the lowest sample rate supported for LINEAR16_PCM, which keeps all frequencies of audio
+        :rtype: int
+        """
+        for sample_rate in YandexSTT.SAMPLE_RATES:
+            if sample_rate >= frame_rate:
+                return sample_rate
+        return YandexSTT.SAMPLE_RATES[-1]
+
+    @staticmethod
+    def prepare_audio(file_name: str):
+        """
+        Choose the cheapest valid encoding for file. OGG Opus is sent as is, mono 16 bit WAV with supported
+        sample rate is sent without header, other audio is decoded and resampled by ffmpeg while it is sent
+        :return: audio chunks, audio encoding and sample rate
+        :rtype: tuple
+        """
+        audio_info = AudioProbe.get_info(file_name)
+
+        if audio_info.codec == 'opus' and audio_info.mime in ('audio/ogg', 'video/ogg'):
+            return iter_chunks(file_name, YandexSTT.CHUNK_SIZE), 'OGG_OPUS', 48000
+
+        sample_rate = YandexSTT.supported_sample_rate(audio_info.frame_rate)
+
+        if audio_info.codec == 'pcm_s16le' and audio_info.channels == 1 and audio_info.frame_rate == sample_rate:
+            return iter_wav_pcm(file_name, YandexSTT.CHUNK_SIZE), 'LINEAR16_PCM', sample_rate
+
+        return iter_decoded_pcm(file_name, YandexSTT.CHUNK_SIZE, sample_rate), 'LINEAR16_PCM', sample_rate
+
+    @staticmethod
+    def gen(folder_id, audio, language_code: str, audio_encoding=None, sample_rate_hertz=None):
+        """
+        :param audio: path to file, bytes-like object, file-like object or iterable of bytes
+        :param audio_encoding: LINEAR16_PCM or OGG_OPUS. If it isn't set for file, encoding and sample rate
+                               are chosen by file properties, other sources are sent as 8000 Hz LINEAR16_PCM
+        :param sample_rate_hertz: sample rate of audio
+        """
+        if audio_encoding is None:
+            if isinstance(audio, str):
+                audio, audio_encoding, sample_rate_hertz = YandexSTT.prepare_audio(audio)
+            else:
+                audio_encoding = 'LINEAR16_PCM'
+
         specification = stt_service_pb2.RecognitionSpec(
             language_code=language_code,
             profanity_filter=True,
             model='general',
             partial_results=True,
-            audio_encoding='LINEAR16_PCM',
-            sample_rate_hertz=8000
+            audio_encoding=audio_encoding,
+            sample_rate_hertz=sample_rate_hertz or 8000
         )
         streaming_config = stt_service_pb2.RecognitionConfig(specification=specification, folder_id=folder_id)
 
         yield stt_service_pb2.StreamingRecognitionRequest(config=streaming_config)
 
-        with open(audio_file_name, 'rb') as f:
-            data = f.read(YandexSTT.CHUNK_SIZE)
-            while data != b'':
-                yield stt_service_pb2.StreamingRecognitionRequest(audio_content=data)
-                data = f.read(YandexSTT.CHUNK_SIZE)
+        for data in iter_chunks(audio, YandexSTT.CHUNK_SIZE):
+            yield stt_service_pb2.StreamingRecognitionRequest(audio_content=data)
 
     @staticmethod
-    def run(folder_id, iam_token, audio_file_name, language_code: str):
-        cred = grpc.ssl_channel_credentials()
-        channel = grpc.secure_channel('stt.api.cloud.yandex.net:443', cred)
-        stub = stt_service_pb2_grpc.SttServiceStub(channel)
+    def stream(folder_id, iam_token, audio, language_code: str, channel=None, audio_encoding=None,
+               sample_rate_hertz=None):
+        """
+        Recognize audio and yield texts as soon as they are received
+        :return: generator of (text, final) tuples, not final texts are partial results of current utterance
+        """
+        stub = stt_service_pb2_grpc.SttServiceStub(channel or YandexSTT.get_channel())
 
-        it = stub.StreamingRecognize(YandexSTT.gen(folder_id, audio_file_name, language_code),
+        requests_iterator = YandexSTT.gen(folder_id, audio, language_code, audio_encoding, sample_rate_hertz)
+        it = stub.StreamingRecognize(requests_iterator,
                                      metadata=(('authorization', 'Bearer %s' % iam_token),))
 
-        strings_answer = []
-        error = None
-        try:
-            for r in it:
-                try:
-                    if r.chunks[0].final:
-                        strings_answer.append(r.chunks[0].alternatives[0].text)
-                except LookupError:
-                    print('Not available chunks')
-        except grpc._channel._Rendezvous as err:
-            error = err
+        # gRPC errors (quota, authorization, timeouts) are raised to caller
+        for r in it:
+            if r.chunks and r.chunks[0].alternatives:
+                yield r.chunks[0].alternatives[0].text, bool(r.chunks[0].final)
+
+    @staticmethod
+    def run(folder_id, iam_token, audio, language_code: str, channel=None, audio_encoding=None,
+            sample_rate_hertz=None):
+        strings_answer = [text for text, final in YandexSTT.stream(folder_id, iam_token, audio, language_code,
+                                                                   channel, audio_encoding, sample_rate_hertz)
+                          if final]
 
         return "\n".join(strings_answer)
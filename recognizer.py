@@ -1,22 +1,53 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import sys
 import argparse
 from lib.recognizers import *
+from lib.batch import collect_files, run_batch
+from lib.server import serve
+from lib import metrics
+from lib.events import recognize_stream
+from lib.live import recognize_live
 
 parser = argparse.ArgumentParser(description='Convert speech to text via various services (Google, Yandex, Wit)')
-parser.add_argument('--file', '-f', dest='file', required=True,
-                    help='Path to media file for recognition')
+input_group = parser.add_mutually_exclusive_group(required=True)
+input_group.add_argument('--file', '-f', dest='file',
+                         help='Path to media file for recognition')
+input_group.add_argument('--batch', '-bt', dest='batch',
+                         help='Directory, glob pattern or JSONL manifest with files for batch recognition')
+input_group.add_argument('--live', '-l', dest='live',
+                         help='Live mono 16 bit PCM for Yandex or Google streaming recognition: "-" (stdin), path to '
+                              'named pipe or growing file, udp://host:port or rtp://host:port (G.711)')
+input_group.add_argument('--serve', '-sv', dest='serve', action='store_true',
+                         help='Run resident HTTP server, which accepts recognition jobs')
 parser.add_argument('--method', '-m', dest='method', default='google',
-                    help='Recognition method (google, yandex, wit) '
+                    help='Recognition method (google, yandex, wit) or comma separated methods in priority order '
                          'default "google"')
+parser.add_argument('--multi-method-mode', '-mm', dest='multi_method_mode', default='fallback',
+                    choices=['fallback', 'race', 'hedge'],
+                    help='How several methods are used: one by one until good result (fallback), all at once (race) '
+                         'or next one after --hedge-delay (hedge) default fallback')
+parser.add_argument('--hedge-delay', dest='hedge_delay', default='30',
+                    help='Seconds to wait for method before the next one is started in hedge mode, default 30')
 parser.add_argument('--language-code', '-lc', dest='language_code', default='en-US',
                     help='Language code, default en-US')
 parser.add_argument('--split-by-silence', '-ss', dest='split_by_silence', default='0',
                     help='Split audio by silence for better recognition (Yandex) (0 or 1) default 1')
+parser.add_argument('--single-pass-split', '-sp', dest='single_pass_split', default='1',
+                    help='Keep parts split by silence in memory instead of temp files cut by ffmpeg (Yandex) (0 or 1) '
+                         'default 1')
+parser.add_argument('--yandex-sample-rate', '-ysr', dest='yandex_sample_rate', default='8000',
+                    choices=['8000', '16000', '48000'],
+                    help='Sample rate of audio split by silence (Yandex) (8000, 16000 or 48000) default 8000')
+parser.add_argument('--yandex-concurrency', '-yc', dest='yandex_concurrency', default='8',
+                    help='Count of audio parts recognized concurrently over one channel (Yandex) default 8')
 parser.add_argument('--use-beta', '-b', dest='beta', default='1',
                     help='Use BETA libraries for Google (0 or 1) default 1')
 parser.add_argument('--confidence', '-c', dest='confidence', default='1',
                     help='Output confidence for Google recognition (BETA) (0 or 1) default 1')
+parser.add_argument('--demux-channels', '-dc', dest='demux_channels', default='0',
+                    help='Recognize every channel separately and merge them into time-ordered dialog '
+                         '(any method) (0 or 1) default 0')
 parser.add_argument('--split-by-channels', '-s', dest='split_by_channels', default='0',
                     help='Split dialog by channels for Google recognition (0 or 1) default 0')
 parser.add_argument('--auto-punctuation', '-p', dest='auto_punctuation', default='0',
@@ -27,6 +58,103 @@ parser.add_argument('--diarization', '-d', dest='diarization', default='0',
                     help='Separating different speakers in an audio recording (Google) (0 or 1) default 0', )
 parser.add_argument('--speaker-count', '-sc', dest='speaker_count', default='0',
                     help='Number of speakers for diarization (Google) default 0', )
+parser.add_argument('--cache', '-ch', dest='cache', default='0',
+                    help='Reuse results of already recognized files with the same settings (0 or 1) default 0', )
+parser.add_argument('--cache-file', dest='cache_file', default=CacheConfig.file_name,
+                    help='SQLite file for cached results', )
+parser.add_argument('--cache-ttl', dest='cache_ttl', default=str(CacheConfig.ttl_seconds),
+                    help='Lifetime of cached results in seconds (0 - unlimited) default 30 days', )
+parser.add_argument('--cache-max-entries', dest='cache_max_entries', default=str(CacheConfig.max_entries),
+                    help='Max count of cached results, least recently used are evicted', )
+parser.add_argument('--cache-max-size', dest='cache_max_size', default=str(CacheConfig.max_size_bytes // 1048576),
+                    help='Max size of cached results in megabytes', )
+parser.add_argument('--google-streaming', '-gs', dest='google_streaming', default='0',
+                    help='Use streaming recognition for files up to 5 minutes (Google) (0 or 1) default 0', )
+parser.add_argument('--http-pool-size', dest='http_pool_size', default=str(HttpConfig.pool_maxsize),
+                    help='Max count of keep-alive connections to one host (Wit, Yandex IAM) default '
+                         + str(HttpConfig.pool_maxsize), )
+parser.add_argument('--http-retries', dest='http_retries', default=str(HttpConfig.max_retries),
+                    help='Count of retries with backoff on 5xx responses (Wit, Yandex IAM) default '
+                         + str(HttpConfig.max_retries), )
+parser.add_argument('--vad-threshold', dest='vad_threshold', default=str(GlobalConfig.vad_threshold),
+                    help='Level of speech in dB for splitting by silence, default ' + str(GlobalConfig.vad_threshold), )
+parser.add_argument('--vad-measure', dest='vad_measure', default=GlobalConfig.vad_measure, choices=['peak', 'rms'],
+                    help='Level measure for splitting by silence, default ' + GlobalConfig.vad_measure, )
+parser.add_argument('--vad-min-silence', dest='vad_min_silence', default=str(GlobalConfig.vad_min_silence),
+                    help='Min pause in seconds between speech segments, default ' + str(GlobalConfig.vad_min_silence), )
+parser.add_argument('--vad-padding', dest='vad_padding', default=str(GlobalConfig.vad_padding),
+                    help='Seconds of silence kept around speech segments, default ' + str(GlobalConfig.vad_padding), )
+parser.add_argument('--vad-merge-gap', dest='vad_merge_gap', default=str(GlobalConfig.vad_merge_gap),
+                    help='Merge padded segments closer than this count of seconds, default '
+                         + str(GlobalConfig.vad_merge_gap), )
+parser.add_argument('--vad-min-speech', dest='vad_min_speech', default=str(GlobalConfig.vad_min_speech),
+                    help='Drop speech segments shorter than this count of seconds, default '
+                         + str(GlobalConfig.vad_min_speech), )
+parser.add_argument('--vad-max-segment', dest='vad_max_segment', default=str(GlobalConfig.vad_max_segment),
+                    help='Cut segments longer than this count of seconds at the quietest point (0 - unlimited), '
+                         'default ' + str(GlobalConfig.vad_max_segment), )
+parser.add_argument('--yandex-segment-target', dest='yandex_segment_target',
+                    default=str(YandexASR.segment_target_duration),
+                    help='Pack adjacent speech segments into one Yandex stream up to this count of seconds, '
+                         'packed segments are returned as one item (0 - stream per segment), default '
+                         + str(YandexASR.segment_target_duration), )
+parser.add_argument('--yandex-segment-max', dest='yandex_segment_max', default=str(YandexASR.segment_max_duration),
+                    help='Cut speech longer than this count of seconds (or 10 MB of PCM) at the quietest point '
+                         '(Yandex), default ' + str(YandexASR.segment_max_duration), )
+parser.add_argument('--google-rps', dest='google_rps', default='0',
+                    help='Max requests per second to Google (0 - unlimited) default 0', )
+parser.add_argument('--google-max-calls', dest='google_max_calls', default='0',
+                    help='Max simultaneous requests to Google (0 - unlimited) default 0', )
+parser.add_argument('--yandex-rps', dest='yandex_rps', default='0',
+                    help='Max streams per second to Yandex (0 - unlimited) default 0', )
+parser.add_argument('--yandex-max-calls', dest='yandex_max_calls', default='0',
+                    help='Max simultaneous streams to Yandex in all files (0 - unlimited) default 0', )
+parser.add_argument('--wit-rps', dest='wit_rps', default='0',
+                    help='Max requests per second to Wit (0 - unlimited) default 0', )
+parser.add_argument('--wit-max-calls', dest='wit_max_calls', default='0',
+                    help='Max simultaneous requests to Wit (0 - unlimited) default 0', )
+parser.add_argument('--quota-retries', dest='quota_retries', default=str(GlobalConfig.quota_retries),
+                    help='Count of retries of requests rejected by provider quota, default '
+                         + str(GlobalConfig.quota_retries), )
+parser.add_argument('--shared-limits', dest='shared_limits', default='0',
+                    help='Share provider limits and quota backoff by all processes with the same --limits-file '
+                         '(0 or 1) default 0', )
+parser.add_argument('--limits-file', dest='limits_file', default=LimitsConfig.file_name,
+                    help='SQLite file for shared provider limits', )
+parser.add_argument('--google-transcode', '-gt', dest='google_transcode', default='0',
+                    help='Transcode audio to compact format before recognition (Google) (0, flac or ogg_opus) '
+                         'default 0', )
+parser.add_argument('--workers', '-w', dest='workers', default='4',
+                    help='Count of concurrent recognitions in batch mode, default 4', )
+parser.add_argument('--host', dest='host', default=ServerConfig.host,
+                    help='Server mode address, default ' + ServerConfig.host, )
+parser.add_argument('--port', dest='port', default=str(ServerConfig.port),
+                    help='Server mode port, default ' + str(ServerConfig.port), )
+parser.add_argument('--warm-up', dest='warm_up', default=None,
+                    help='Comma separated methods to prepare in server mode, default the --method value', )
+parser.add_argument('--timings', '-t', dest='timings', default='0',
+                    help='Add spans of pipeline stages to output, result is moved to "result" key (0 or 1) default 0', )
+parser.add_argument('--metrics-file', dest='metrics_file', default=None,
+                    help='Write process metrics in Prometheus text format to file after recognition', )
+parser.add_argument('--stream-output', '-so', dest='stream_output', default='0',
+                    help='Print newline-delimited JSON events (utterance, error, end) as soon as results are '
+                         'received (0 or 1) default 0', )
+parser.add_argument('--partials', dest='partials', default='0',
+                    help='Print "partial" events with not final texts in stream output mode (Yandex, Google '
+                         'streaming) (0 or 1) default 0', )
+parser.add_argument('--live-sample-rate', dest='live_sample_rate', default=str(LiveConfig.sample_rate_hertz),
+                    help='Sample rate of live audio, default ' + str(LiveConfig.sample_rate_hertz), )
+parser.add_argument('--live-buffer', dest='live_buffer', default=str(LiveConfig.queue_size),
+                    help='Count of ' + str(LiveConfig.chunk_duration) + ' s chunks buffered between live source and '
+                         'recognition, default ' + str(LiveConfig.queue_size), )
+parser.add_argument('--live-idle-timeout', dest='live_idle_timeout', default=str(LiveConfig.idle_timeout),
+                    help='Stop live recognition, if growing file or socket gets no audio for this count of seconds, '
+                         'default ' + str(LiveConfig.idle_timeout), )
+parser.add_argument('--live-rtp-payload-type', dest='live_rtp_payload_type', default=None,
+                    help='Dynamic RTP payload type of mono L16 audio, packets of other dynamic types are dropped, '
+                         'default none', )
+parser.add_argument('--output', '-o', dest='output', default=None,
+                    help='File for JSONL results in batch mode, default stdout', )
 
 yes_list = ['1', 'true', 'y', 'yes']
 
@@ -34,45 +162,100 @@ args = parser.parse_args()
 file = args.file
 method = args.method
 GlobalConfig.language_code = args.language_code
+GlobalConfig.demux_channels = args.demux_channels.lower() in yes_list
+GlobalConfig.multi_method_mode = args.multi_method_mode
+GlobalConfig.vad_threshold = float(args.vad_threshold)
+GlobalConfig.vad_measure = args.vad_measure
+GlobalConfig.vad_min_silence = float(args.vad_min_silence)
+GlobalConfig.vad_padding = float(args.vad_padding)
+GlobalConfig.vad_merge_gap = float(args.vad_merge_gap)
+GlobalConfig.vad_min_speech = float(args.vad_min_speech)
+GlobalConfig.vad_max_segment = float(args.vad_max_segment)
+GlobalConfig.hedge_delay = float(args.hedge_delay)
 YandexASR.split_by_silence = args.split_by_silence.lower() in yes_list
+YandexASR.single_pass_split = args.single_pass_split.lower() in yes_list
+YandexASR.sample_rate_hertz = int(args.yandex_sample_rate)
+YandexASR.max_concurrent_streams = int(args.yandex_concurrency)
+YandexASR.segment_target_duration = float(args.yandex_segment_target)
+YandexASR.segment_max_duration = float(args.yandex_segment_max)
 GoogleASR.confidence = args.confidence.lower() in yes_list
 GoogleASR.use_beta = args.beta.lower() in yes_list
 GoogleASR.split_by_channels = args.split_by_channels.lower() in yes_list
 GoogleASR.automatic_punctuation = args.auto_punctuation.lower() in yes_list
 GoogleASR.enable_speaker_diarization = args.diarization.lower() in yes_list
 GoogleASR.diarization_speaker_count = int(args.speaker_count)
+GoogleASR.streaming = args.google_streaming.lower() in yes_list
+GoogleASR.transcode = None if args.google_transcode == '0' else args.google_transcode.lower()
 
-if args.phrases_file != "0" and os.path.isfile(args.phrases_file):
-    with open(os.path.abspath(args.phrases_file), 'r') as phrases_file:
-        GoogleASR.phrases_list = phrases_file.read().split("\n")
+GlobalConfig.quota_retries = int(args.quota_retries)
+GoogleASR.requests_per_second = float(args.google_rps)
+GoogleASR.max_concurrent_calls = int(args.google_max_calls)
+YandexASR.requests_per_second = float(args.yandex_rps)
+YandexASR.max_concurrent_calls = int(args.yandex_max_calls)
+WitASR.requests_per_second = float(args.wit_rps)
+WitASR.max_concurrent_calls = int(args.wit_max_calls)
+
+LimitsConfig.shared = args.shared_limits.lower() in yes_list
+LimitsConfig.file_name = args.limits_file
+
+HttpConfig.pool_maxsize = int(args.http_pool_size)
+HttpConfig.max_retries = int(args.http_retries)
+
+ServerConfig.host = args.host
+ServerConfig.port = int(args.port)
+ServerConfig.workers = int(args.workers)
+
+LiveConfig.sample_rate_hertz = int(args.live_sample_rate)
+LiveConfig.queue_size = int(args.live_buffer)
+LiveConfig.idle_timeout = float(args.live_idle_timeout)
+LiveConfig.rtp_payload_type = int(args.live_rtp_payload_type) if args.live_rtp_payload_type else None
 
+MetricsConfig.timings = args.timings.lower() in yes_list
+MetricsConfig.metrics_file = args.metrics_file
 
-def recognize(file_name, method_name):
-    try:
-        file_object = os.path.abspath(file_name)
-        if not os.path.isfile(file_object):
-            raise IOError("File doesn't exists")
-    except IOError as err:
-        return {'error': "Caught error \"" + err.strerror + "\" in file " + err.filename}
+CacheConfig.enabled = args.cache.lower() in yes_list
+CacheConfig.file_name = args.cache_file
+CacheConfig.ttl_seconds = int(args.cache_ttl)
+CacheConfig.max_entries = int(args.cache_max_entries)
+CacheConfig.max_size_bytes = int(args.cache_max_size) * 1048576
 
-    type_name = method_name
+if args.phrases_file != "0" and os.path.isfile(args.phrases_file):
+    with open(os.path.abspath(args.phrases_file), 'r') as phrases_file:
+        GoogleASR.phrases_list = phrases_file.read().split("\n")
 
-    operations = {
-        'yandex': type_yandex,
-        'google': type_google,
-        'wit': type_wit
-    }
 
-    if type_name in operations:
-        result = operations[type_name](file_object)
-        if not result:
-            return {'error': 'Empty result was returned'}
+if __name__ == "__main__":
+    if args.serve:
+        serve(method, args.warm_up.split(',') if args.warm_up else None)
+    elif args.batch:
+        batch_jobs = collect_files(args.batch, method)
+        if args.output:
+            with open(args.output, 'a') as output_file:
+                batch_errors = run_batch(batch_jobs, int(args.workers), output_file)
         else:
-            return result
+            batch_errors = run_batch(batch_jobs, int(args.workers))
+    elif args.live or args.stream_output.lower() in yes_list:
+        if args.live:
+            events = recognize_live(args.live, method, args.partials.lower() in yes_list)
+        else:
+            events = recognize_stream(file, method, args.partials.lower() in yes_list)
+
+        with metrics.trace() as job_trace:
+            for event in events:
+                if event['event'] == 'end' and MetricsConfig.timings:
+                    event['timings'] = job_trace.to_dict()
+                print(json.dumps(event), flush=True)
     else:
-        return {'error': 'Unknown recognition method'}
+        with metrics.trace() as job_trace:
+            result_rec = recognize(file, method)
+        if MetricsConfig.timings:
+            result_rec = {'result': result_rec, 'timings': job_trace.to_dict()}
+        print(json.dumps(result_rec))
 
+    if MetricsConfig.metrics_file:
+        with open(MetricsConfig.metrics_file, 'w') as metrics_file:
+            metrics_file.write(metrics.registry.to_prometheus())
 
-if __name__ == "__main__":
-    result_rec = recognize(file, method)
-    print(json.dumps(result_rec))
+    if args.batch and batch_errors:
+        # Failed files are reported in their lines, exit status tells that there are any
+        sys.exit(1)
@@ -0,0 +1,55 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from lib import batch
+
+
+class ManifestTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_name)
+
+    def write_manifest(self, lines: list):
+        file_name = os.path.join(self.dir_name, 'manifest.jsonl')
+        with open(file_name, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        return file_name
+
+    def test_lines_are_jobs(self):
+        manifest = self.write_manifest(['"a.wav"', '', '{"file": "b.wav", "method": "wit", "id": 7}'])
+
+        self.assertEqual(batch.read_manifest(manifest, 'yandex'), [
+            {'file': os.path.join(self.dir_name, 'a.wav'), 'method': 'yandex'},
+            {'file': os.path.join(self.dir_name, 'b.wav'), 'method': 'wit', 'id': 7}
+        ])
+
+    def test_malformed_lines_are_error_jobs(self):
+        manifest = self.write_manifest(['"a.wav"', '{"file": ', '{"method": "wit"}', '[1, 2]'])
+        jobs = batch.read_manifest(manifest, 'yandex')
+
+        self.assertEqual(len(jobs), 4)
+        self.assertEqual([job.get('line') for job in jobs[1:]], [2, 3, 4])
+        self.assertTrue(all('error' in job and 'file' not in job for job in jobs[1:]))
+
+    def test_error_lines_are_failed_results(self):
+        manifest = self.write_manifest(['"a.wav"', 'not json'])
+        output = io.StringIO()
+
+        with mock.patch.object(batch, 'recognize', return_value=[{'text': 'hello'}]) as recognize:
+            errors = batch.run_batch(batch.read_manifest(manifest, 'yandex'), workers=2, output=output)
+
+        recognize.assert_called_once_with(os.path.join(self.dir_name, 'a.wav'), 'yandex')
+        lines = sorted((json.loads(line) for line in output.getvalue().splitlines()), key=lambda line: 'line' in line)
+        self.assertEqual(errors, 1)
+        self.assertEqual(lines[0]['result'], [{'text': 'hello'}])
+        self.assertEqual(lines[1]['line'], 2)
+        self.assertIn('error', lines[1]['result'])
+
+
+if __name__ == '__main__':
+    unittest.main()
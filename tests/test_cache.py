@@ -0,0 +1,96 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from lib import cache
+from lib.cache import ResultCache
+
+
+class FakeClock(object):
+    """Replacement of time module in lib.cache, every call returns the next second
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_name)
+        self.file_name = os.path.join(self.dir_name, 'results.sqlite')
+
+        self.clock = FakeClock()
+        patcher = mock.patch.object(cache, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_file(self, name: str, content: bytes):
+        file_name = os.path.join(self.dir_name, name)
+        with open(file_name, 'wb') as f:
+            f.write(content)
+        return file_name
+
+    def test_result_is_stored(self):
+        result_cache = ResultCache(self.file_name)
+        result = [{'text': 'hello', 'audio_part_start_time': 0}]
+        result_cache.put('key', result)
+
+        self.assertEqual(result_cache.get('key'), result)
+        self.assertIsNone(result_cache.get('other'))
+        # Cache is shared through the file
+        self.assertEqual(ResultCache(self.file_name).get('key'), result)
+
+    def test_least_recently_used_is_evicted(self):
+        result_cache = ResultCache(self.file_name, max_entries=2)
+        result_cache.put('first', ['first'])
+        result_cache.put('second', ['second'])
+        result_cache.get('first')
+        result_cache.put('third', ['third'])
+
+        self.assertEqual(result_cache.get('first'), ['first'])
+        self.assertIsNone(result_cache.get('second'))
+        self.assertEqual(result_cache.get('third'), ['third'])
+
+    def test_results_expire(self):
+        result_cache = ResultCache(self.file_name, ttl_seconds=10)
+        result_cache.put('old', ['old'])
+        self.clock.now += 5
+        result_cache.put('new', ['new'])
+        self.assertEqual(result_cache.get('old'), ['old'])
+
+        self.clock.now += 5
+        self.assertIsNone(result_cache.get('old'))
+        self.assertEqual(result_cache.get('new'), ['new'])
+
+    def test_size_limit_evicts_oldest(self):
+        result = ['x' * 100]
+        result_cache = ResultCache(self.file_name, max_size_bytes=250)
+        for key in ('first', 'second', 'third'):
+            result_cache.put(key, result)
+
+        self.assertIsNone(result_cache.get('first'))
+        self.assertEqual(result_cache.get('second'), result)
+        self.assertEqual(result_cache.get('third'), result)
+
+    def test_key_depends_on_content_and_settings(self):
+        first = self.write_file('first.wav', b'audio')
+        copy = self.write_file('copy.wav', b'audio')
+        other = self.write_file('other.wav', b'other audio')
+        settings = {'language_code': 'en-US'}
+
+        key = ResultCache.make_key(first, 'yandex', settings)
+        self.assertEqual(ResultCache.make_key(copy, 'yandex', settings), key)
+        self.assertNotEqual(ResultCache.make_key(other, 'yandex', settings), key)
+        self.assertNotEqual(ResultCache.make_key(first, 'wit', settings), key)
+        self.assertNotEqual(ResultCache.make_key(first, 'yandex', {'language_code': 'ru-RU'}), key)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+from types import SimpleNamespace
+
+from lib import limits
+from lib.limits import LimiterState, ProviderLimiter, QuotaError, is_quota_error
+from lib.credentials import GlobalConfig
+
+NOW = 1000.0
+
+
+class LimitedConfig(GlobalConfig):
+    requests_per_second = 10
+    requests_burst = 1
+    quota_retries = 2
+    quota_backoff = 1.0
+    quota_backoff_max = 3
+
+
+class BurstConfig(LimitedConfig):
+    requests_burst = 3
+
+
+class FakeClock(object):
+    """Replacement of time module in lib.limits: sleep moves the clock instead of waiting
+    """
+
+    def __init__(self, now=NOW):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class LimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(limits, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_requests_are_spaced_by_rate(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        delays = [limiter.reserve() for _ in range(3)]
+        for delay, expected in zip(delays, (0, 0.1, 0.2)):
+            self.assertAlmostEqual(delay, expected)
+
+    def test_burst_is_sent_at_once(self):
+        limiter = ProviderLimiter('test', BurstConfig)
+        delays = [limiter.reserve() for _ in range(4)]
+        for delay, expected in zip(delays, (0, 0, 0, 0.1)):
+            self.assertAlmostEqual(delay, expected)
+
+        # Tokens are restored after idle time
+        self.clock.now += 10
+        self.assertEqual(limiter.reserve(), 0)
+
+    def test_unlimited_rate(self):
+        limiter = ProviderLimiter('test', GlobalConfig)
+        self.assertEqual([limiter.reserve() for _ in range(5)], [0] * 5)
+
+    def test_quota_errors_back_off_exponentially(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        self.assertEqual([limiter.penalize(QuotaError('quota')) for _ in range(3)], [1.0, 2.0, 3.0])
+        self.assertAlmostEqual(limiter.reserve(), 3.0)
+
+        with limiter.state.transaction('test') as state:
+            self.assertEqual(state['failures'], 3)
+            self.assertAlmostEqual(state['factor'], 0.125)
+
+        limiter.succeed()
+        with limiter.state.transaction('test') as state:
+            self.assertEqual(state['failures'], 0)
+            self.assertAlmostEqual(state['factor'], 0.175)
+
+    def test_retry_after_of_provider_is_used(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        self.assertEqual(limiter.penalize(QuotaError('quota', 2.5)), 2.5)
+
+    def test_call_repeats_rejected_requests(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        responses = [QuotaError('quota'), QuotaError('quota'), 'result']
+
+        def request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual(limiter.call(request), 'result')
+        self.assertEqual(self.clock.sleeps, [1.0, 2.0])
+
+    def test_call_gives_up_after_retries(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        attempts = []
+
+        def request():
+            attempts.append(True)
+            raise QuotaError('quota')
+
+        self.assertRaises(QuotaError, limiter.call, request)
+        self.assertEqual(len(attempts), LimitedConfig.quota_retries + 1)
+
+    def test_other_errors_are_not_repeated(self):
+        limiter = ProviderLimiter('test', LimitedConfig)
+        attempts = []
+
+        def request():
+            attempts.append(True)
+            raise IOError('connection reset')
+
+        self.assertRaises(IOError, limiter.call, request)
+        self.assertEqual(len(attempts), 1)
+
+
+class QuotaErrorTest(unittest.TestCase):
+    def test_quota_errors_of_clients(self):
+        class RpcError(Exception):
+            def __init__(self, name):
+                super(RpcError, self).__init__(name)
+                self.name = name
+
+            def code(self):
+                return SimpleNamespace(name=self.name)
+
+        class HttpError(Exception):
+            code = 429
+
+        self.assertTrue(is_quota_error(QuotaError('quota')))
+        self.assertTrue(is_quota_error(RpcError('RESOURCE_EXHAUSTED')))
+        self.assertTrue(is_quota_error(HttpError()))
+        self.assertFalse(is_quota_error(RpcError('UNAVAILABLE')))
+        self.assertFalse(is_quota_error(IOError('connection reset')))
+
+
+class SharedStateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_name)
+        self.file_name = os.path.join(self.dir_name, 'limits.sqlite')
+
+        patcher = mock.patch.object(limits, 'time', FakeClock())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_processes_share_tokens_and_backoff(self):
+        # Every limiter has its own connection to the same file, like limiters of different processes
+        first = ProviderLimiter('test', LimitedConfig, LimiterState(self.file_name))
+        second = ProviderLimiter('test', LimitedConfig, LimiterState(self.file_name))
+
+        self.assertEqual(first.reserve(), 0)
+        self.assertAlmostEqual(second.reserve(), 0.1)
+
+        first.penalize(QuotaError('quota'))
+        self.assertAlmostEqual(second.reserve(), 1.0)
+
+    def test_providers_are_limited_separately(self):
+        state = LimiterState(self.file_name)
+        first = ProviderLimiter('first', LimitedConfig, state)
+        second = ProviderLimiter('second', LimitedConfig, state)
+
+        first.reserve()
+        self.assertEqual(second.reserve(), 0)
+
+
+@unittest.skipIf(limits.fcntl is None, 'Lock files need fcntl')
+class LockFilesTest(unittest.TestCase):
+    def setUp(self):
+        self.dir_name = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir_name)
+        self.file_name = os.path.join(self.dir_name, 'limits.sqlite')
+
+    def test_processes_share_slots_of_concurrent_calls(self):
+        class OneCallConfig(GlobalConfig):
+            max_concurrent_calls = 1
+
+        lock_dir = os.path.join(self.dir_name, 'locks')
+        first = ProviderLimiter('test', OneCallConfig, LimiterState(self.file_name), lock_dir)
+        second = ProviderLimiter('test', OneCallConfig, LimiterState(self.file_name), lock_dir)
+
+        acquired = threading.Event()
+        lock_file = first.acquire()
+        try:
+            thread = threading.Thread(target=lambda: second.release(second.acquire()) or acquired.set(),
+                                      daemon=True)
+            thread.start()
+            self.assertFalse(acquired.wait(0.3))
+        finally:
+            first.release(lock_file)
+
+        self.assertTrue(acquired.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
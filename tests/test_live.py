@@ -0,0 +1,132 @@
+import socket
+import warnings
+import threading
+import unittest
+from unittest import mock
+
+from lib import live
+from lib.live import LiveAudio, ReplayableChunks, rtp_payload
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:
+    audioop = None
+
+
+def rtp_packet(payload_type: int, payload: bytes, ssrc=1, csrc_count=0, extension=b'', padding=0):
+    """
+    Build RTP packet: version 2, optional CSRC list, header extension and padding
+    """
+    first = 0x80 | csrc_count | (0x10 if extension else 0) | (0x20 if padding else 0)
+    packet = bytes([first, payload_type, 0, 1, 0, 0, 0, 160]) + ssrc.to_bytes(4, 'big') + bytes(4 * csrc_count)
+    if extension:
+        packet += b'\xbe\xde' + (len(extension) // 4).to_bytes(2, 'big') + extension
+    packet += payload
+    if padding:
+        packet += bytes(padding - 1) + bytes([padding])
+    return packet
+
+
+class FakeSocket(object):
+    """UDP socket, which receives given packets and then times out
+    """
+
+    def __init__(self, packets):
+        self.packets = list(packets)
+
+    def bind(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        pass
+
+    def recv(self, size):
+        if not self.packets:
+            raise socket.timeout()
+        return self.packets.pop(0)
+
+    def close(self):
+        pass
+
+
+class RtpTest(unittest.TestCase):
+    def test_l16_is_converted_to_little_endian(self):
+        self.assertEqual(rtp_payload(rtp_packet(live.RTP_L16_MONO, b'\x00\x01\x12\x34\x56')), b'\x01\x00\x34\x12')
+        self.assertEqual(rtp_payload(rtp_packet(96, b'\x00\x01'), 96), b'\x01\x00')
+
+    @unittest.skipIf(audioop is None, 'G.711 is decoded with audioop')
+    def test_g711_is_decoded(self):
+        payload = b'\x00\x7f\x80\xff'
+        self.assertEqual(rtp_payload(rtp_packet(live.RTP_PCMU, payload)), audioop.ulaw2lin(payload, 2))
+        self.assertEqual(rtp_payload(rtp_packet(live.RTP_PCMA, payload)), audioop.alaw2lin(payload, 2))
+
+    def test_headers_and_padding_are_skipped(self):
+        packet = rtp_packet(live.RTP_L16_MONO, b'\x00\x01', csrc_count=2, extension=b'\x00' * 8, padding=4)
+        self.assertEqual(rtp_payload(packet), b'\x01\x00')
+
+    def test_not_audio_payloads_are_dropped(self):
+        # Telephone events, comfort noise, stereo L16 and dynamic type, which isn't configured
+        for payload_type in (101, 13, 10, 96):
+            self.assertIsNone(rtp_payload(rtp_packet(payload_type, b'\x00\x01')))
+
+    def test_not_rtp_is_dropped(self):
+        self.assertIsNone(rtp_payload(b'\x00\x01'))
+        self.assertIsNone(rtp_payload(b'\x40' + bytes(15)))
+
+    def test_only_the_first_stream_is_read(self):
+        packets = [
+            rtp_packet(101, b'\x00\x01', ssrc=3),
+            rtp_packet(live.RTP_L16_MONO, b'\x00\x01', ssrc=1),
+            rtp_packet(live.RTP_L16_MONO, b'\x00\x02', ssrc=2),
+            rtp_packet(live.RTP_L16_MONO, b'\x00\x03', ssrc=1)
+        ]
+
+        with mock.patch.object(live.socket, 'socket', return_value=FakeSocket(packets)):
+            self.assertEqual(list(live.read_socket('127.0.0.1', 40000, True, 1)), [b'\x01\x00', b'\x03\x00'])
+
+
+class LiveAudioTest(unittest.TestCase):
+    def test_sessions_are_cut_at_max_bytes(self):
+        audio = LiveAudio(iter([b'abc', b'defg', b'hij']), 10)
+
+        self.assertEqual(list(audio.session(4)), [b'abc', b'd'])
+        self.assertTrue(audio.has_audio())
+        self.assertEqual(list(audio.session(4)), [b'efg', b'h'])
+        self.assertEqual(list(audio.session(4)), [b'ij'])
+        self.assertFalse(audio.has_audio())
+        self.assertEqual(audio.offset, 10)
+
+    def test_source_error_is_kept(self):
+        def chunks():
+            yield b'ab'
+            raise IOError('source is broken')
+
+        audio = LiveAudio(chunks(), 10)
+        self.assertEqual(list(audio.session(100)), [b'ab'])
+        self.assertFalse(audio.has_audio())
+        self.assertIsInstance(audio.error, IOError)
+
+    def test_the_oldest_audio_is_dropped(self):
+        sent = threading.Event()
+
+        def chunks():
+            for index in range(5):
+                yield bytes([index])
+            sent.set()
+
+        audio = LiveAudio(chunks(), 2, drop=True)
+        self.assertTrue(sent.wait(5))
+        self.assertEqual(list(audio.session(100)), [b'\x03', b'\x04'])
+
+    def test_session_is_replayed(self):
+        chunks = ReplayableChunks(iter([b'a', b'b', b'c']))
+        first = iter(chunks)
+        self.assertEqual(next(first), b'a')
+        self.assertEqual(list(chunks), [b'a', b'b', b'c'])
+        self.assertEqual(list(first), [b'b', b'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
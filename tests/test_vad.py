@@ -0,0 +1,119 @@
+import math
+import random
+import unittest
+from array import array
+
+from lib import vad
+from lib.credentials import GlobalConfig
+
+SAMPLE_RATE = 8000
+
+
+def tone(seconds: float, amplitude=8000):
+    return array('h', (int(amplitude * math.sin(2 * math.pi * 440 * index / SAMPLE_RATE))
+                       for index in range(int(seconds * SAMPLE_RATE)))).tobytes()
+
+
+def silence(seconds: float):
+    return bytes(int(seconds * SAMPLE_RATE) * 2)
+
+
+def noisy_speech(seed: int, seconds: int):
+    """
+    Deterministic PCM with bursts of loud noise between quiet noise
+    """
+    generator = random.Random(seed)
+    samples = array('h')
+    while len(samples) < seconds * SAMPLE_RATE:
+        amplitude = generator.choice((100, 200, 6000, 12000))
+        length = generator.randint(SAMPLE_RATE // 20, SAMPLE_RATE * 2)
+        samples.extend(generator.randint(-amplitude, amplitude) for _ in range(length))
+    return samples.tobytes()
+
+
+class VadConfig(GlobalConfig):
+    pass
+
+
+class RunsTest(unittest.TestCase):
+    def test_merge_runs(self):
+        self.assertEqual(vad.merge_runs([[0, 2], [3, 5], [10, 12]], 1), [[0, 5], [10, 12]])
+        self.assertEqual(vad.merge_runs([[0, 2], [4, 5]], 1), [[0, 2], [4, 5]])
+        self.assertEqual(vad.merge_runs([], 5), [])
+
+    def test_split_long_runs(self):
+        levels = [10] * 20
+        levels[7] = 1
+        self.assertEqual(vad.split_long_runs([[0, 20]], levels, 10), [[0, 7], [7, 12], [12, 20]])
+        self.assertEqual(vad.split_long_runs([[0, 20]], levels, 0), [[0, 20]])
+        self.assertEqual(vad.split_long_runs([[0, 3]], levels, 1), [[0, 1], [1, 2], [2, 3]])
+
+    def test_pack_runs(self):
+        runs = [[0, 3], [4, 8], [9, 15], [16, 18]]
+        self.assertEqual(vad.pack_runs(runs, 10), [[0, 8], [9, 18]])
+        self.assertEqual(vad.pack_runs(runs, 20, 10), [[0, 8], [9, 18]])
+        self.assertEqual(vad.pack_runs(runs, 0), runs)
+
+
+class DetectSpeechTest(unittest.TestCase):
+    def test_segments_are_padded(self):
+        pcm = silence(1) + tone(1) + silence(1) + tone(0.5) + silence(1)
+        self.assertEqual(vad.detect_speech(pcm, SAMPLE_RATE, VadConfig), [[6000, 18000], [22000, 30000]])
+
+    def test_short_pause_is_kept_inside_segment(self):
+        pcm = silence(1) + tone(1) + silence(0.3) + tone(1) + silence(1)
+        self.assertEqual(vad.detect_speech(pcm, SAMPLE_RATE, VadConfig), [[6000, 28400]])
+
+    def test_no_speech_is_one_segment(self):
+        self.assertEqual(vad.detect_speech(silence(2), SAMPLE_RATE, VadConfig), [[0, 16000]])
+        self.assertEqual(vad.detect_speech(b'', SAMPLE_RATE, VadConfig), [])
+
+    def test_segments_are_limited_and_packed(self):
+        class LimitedConfig(VadConfig):
+            segment_target_duration = 3
+            segment_max_duration = 2
+
+        segments = vad.detect_speech(noisy_speech(1, 30), SAMPLE_RATE, LimitedConfig)
+        self.assertTrue(all(end - start <= 2 * SAMPLE_RATE for start, end in segments))
+        self.assertTrue(all(start < end for start, end in segments))
+        self.assertEqual(segments, sorted(segments))
+
+    def test_segments_fit_request_size(self):
+        class SizeConfig(VadConfig):
+            segment_max_bytes = 4 * SAMPLE_RATE * 2
+
+        segments = vad.detect_speech(tone(10), SAMPLE_RATE, SizeConfig)
+        self.assertEqual(segments[-1][1], 10 * SAMPLE_RATE)
+        self.assertTrue(all((end - start) * 2 <= SizeConfig.segment_max_bytes for start, end in segments))
+
+
+class BackendsTest(unittest.TestCase):
+    def setUp(self):
+        self.numpy = vad.get_numpy()
+        if self.numpy is None:
+            self.skipTest('NumPy is not installed')
+
+    def tearDown(self):
+        vad.numpy = self.numpy
+
+    def detect_without_numpy(self, pcm, config):
+        vad.numpy = None
+        try:
+            return vad.detect_speech(pcm, SAMPLE_RATE, config)
+        finally:
+            vad.numpy = self.numpy
+
+    def test_numpy_and_pure_python_find_the_same_segments(self):
+        class RmsConfig(VadConfig):
+            vad_measure = 'rms'
+            vad_max_segment = 3
+
+        for config in (VadConfig, RmsConfig):
+            for seed in range(3):
+                # Odd length checks the short last block and the incomplete sample
+                pcm = noisy_speech(seed, 20) + b'\x01'
+                self.assertEqual(vad.detect_speech(pcm, SAMPLE_RATE, config), self.detect_without_numpy(pcm, config))
+
+
+if __name__ == '__main__':
+    unittest.main()